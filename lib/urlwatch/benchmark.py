@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of urlwatch (https://thp.io/2008/urlwatch/).
+# Copyright (c) 2008-2024 Thomas Perl <m@thp.io>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmarks for urlwatch, run "python -m urlwatch.benchmark --help" for usage"""
+
+import argparse
+import contextlib
+import copy
+import http.server
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import zlib
+
+import urlwatch
+from . import worker
+from .filters import FilterBase
+from .handler import JobState, Report
+from .jobs import UrlJob
+from .storage import DEFAULT_CONFIG, CacheDirStorage, CacheMiniDBStorage, CacheRedisStorage
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+         'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua')
+
+
+def page_changed(page_id, run, change_percent):
+    # Deterministic, so that all benchmark runs see the same changes
+    return run > 0 and zlib.crc32('{}:{}'.format(page_id, run).encode()) % 100 < change_percent
+
+
+def generate_page(page_id, run, size, change_percent):
+    version = max((r for r in range(run + 1) if page_changed(page_id, r, change_percent)), default=0)
+    return generate_html(size, '{}:{}'.format(page_id, version)).encode()
+
+
+def _generate(size, head, tail, make_item, separator='\n'):
+    items = []
+    length = len(head) + len(tail)
+    while length < size or not items:
+        item = make_item(len(items))
+        items.append(item)
+        length += len(item) + len(separator)
+    return head + separator.join(items) + tail
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def generate_html(size, seed=0):
+    rng = random.Random(seed)
+    return _generate(size, '<html><head><title>Page {}</title></head><body><div id="main">\n'.format(seed),
+                     '\n</div></body></html>',
+                     lambda idx: '<p class="item" style="color: red">{} {}</p>'.format(idx, _words(rng, 12)))
+
+
+def generate_xml(size, seed=0):
+    rng = random.Random(seed)
+    return _generate(size, '<?xml version="1.0" encoding="UTF-8"?>\n<items>', '</items>',
+                     lambda idx: '<item id="{}"><name>{}</name><value>{}</value></item>'.format(
+                         idx, _words(rng, 3), rng.randint(0, 1000)), separator='')
+
+
+def generate_json(size, seed=0):
+    rng = random.Random(seed)
+    return _generate(size, '{"items": [', ']}', lambda idx: json.dumps({
+        'id': idx, 'name': _words(rng, 3), 'value': rng.randint(0, 1000), 'tags': _words(rng, 4).split(),
+    }), separator=', ')
+
+
+def generate_csv(size, seed=0):
+    rng = random.Random(seed)
+    return _generate(size, 'Name,Value,Description\n', '',
+                     lambda idx: '{},{},{}'.format(_words(rng, 2), rng.randint(0, 1000), _words(rng, 8)))
+
+
+def generate_ical(size, seed=0):
+    rng = random.Random(seed)
+    return _generate(size, 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//urlwatch//benchmark//EN\r\n',
+                     '\r\nEND:VCALENDAR\r\n', lambda idx: '\r\n'.join((
+                         'BEGIN:VEVENT', 'UID:{}@example.org'.format(idx), 'DTSTAMP:20240101T000000Z',
+                         'DTSTART:202401{:02d}T120000Z'.format(idx % 28 + 1), 'SUMMARY:{}'.format(_words(rng, 4)),
+                         'DESCRIPTION:{}'.format(_words(rng, 10)), 'END:VEVENT')), separator='\r\n')
+
+
+def generate_pdf(size, seed=0):
+    rng = random.Random(seed)
+    streams = []
+    length = 0
+    while length < size or not streams:
+        lines = ' '.join("({}) '".format(_words(rng, 10)) for _ in range(50))
+        streams.append('BT /F1 10 Tf 50 780 Td 12 TL {} ET'.format(lines))
+        length += len(streams[-1])
+
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for stream in streams:
+        objects.append('<< /Length {} >>\nstream\n{}\nendstream'.format(len(stream), stream))
+        objects.append('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >>'
+                       ' /Contents {} 0 R >>'.format(len(objects)))
+        kids.append('{} 0 R'.format(len(objects)))
+    objects[1] = '<< /Type /Pages /Kids [{}] /Count {} >>'.format(' '.join(kids), len(kids))
+
+    pdf = b'%PDF-1.4\n'
+    offsets = []
+    for idx, obj in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += '{} 0 obj\n{}\nendobj\n'.format(idx, obj).encode()
+    xref = len(pdf)
+    pdf += 'xref\n0 {}\n0000000000 65535 f \n'.format(len(objects) + 1).encode()
+    pdf += ''.join('{:010d} 00000 n \n'.format(offset) for offset in offsets).encode()
+    pdf += 'trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(len(objects) + 1, xref).encode()
+    return pdf
+
+
+CORPORA = {
+    'html': generate_html,
+    'xml': generate_xml,
+    'json': generate_json,
+    'csv': generate_csv,
+    'ical': generate_ical,
+    'pdf': generate_pdf,
+}
+
+# Corpus and subfilter used to benchmark each filter kind (other filters are run on HTML without subfilter)
+FILTER_BENCHMARKS = {
+    'csv2text': ('csv', {'format_message': '{name}: {value}', 'has_header': True, 'ignore_header': False}),
+    'pdf2text': ('pdf', {}),
+    'ical2text': ('ical', {}),
+    'format-json': ('json', {}),
+    'pretty-xml': ('xml', {}),
+    'grep': ('html', {'re': 'lorem'}),
+    'grepi': ('html', {'re': 'lorem'}),
+    'element-by-id': ('html', {'id': 'main'}),
+    'element-by-class': ('html', {'class': 'item'}),
+    'element-by-style': ('html', {'style': 'color: red'}),
+    'element-by-tag': ('html', {'tag': 'p'}),
+    'css': ('html', {'selector': 'p.item'}),
+    'xpath': ('html', {'path': '//p[@class="item"]'}),
+    're.sub': ('html', {'pattern': '[0-9]+'}),
+    're.findall': ('html', {'pattern': '[a-z]+'}),
+    'shellpipe': ('html', {'command': 'cat'}),
+    'jq': ('json', {'query': '.items[].name'}),
+    'ocr': (None, {}),
+}
+
+# Default corpus sizes in bytes (small, medium, large)
+CORPUS_SIZES = (1024, 64 * 1024, 1024 * 1024)
+
+
+class FixtureServer(object):
+    """Local HTTP server with synthetic pages (at /page/<id>) that change deterministically in each run"""
+
+    def __init__(self, size=10000, change_percent=10):
+        self.size = size
+        self.change_percent = change_percent
+        self.run = 0
+
+        fixture = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                try:
+                    page_id = int(self.path.split('/')[2])
+                except (IndexError, ValueError):
+                    self.send_error(404)
+                    return
+
+                body = generate_page(page_id, fixture.run, fixture.size, fixture.change_percent)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            # Avoid connection retries (and skewed latencies) with many workers
+            request_queue_size = 128
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fixture-server', daemon=True)
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server.server_address)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def peak_rss():
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if len(values) < 2:
+        return {'p{}'.format(point): (values[0] if values else None) for point in points}
+
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p{}'.format(point): quantiles[point - 1] for point in points}
+
+
+def open_cache(cache, tmpdir):
+    if cache == 'minidb':
+        return CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+    if cache == 'dir':
+        return CacheDirStorage(os.path.join(tmpdir, 'cache'))
+    if cache.startswith(('redis://', 'rediss://')):
+        cache_storage = CacheRedisStorage(cache)
+        # The benchmarks clean up and garbage-collect the cache, which would remove existing entries
+        if any(True for _ in cache_storage.get_guids()):
+            cache_storage.close()
+            raise ValueError('Redis cache {} is not empty, use a dedicated database for benchmarks'.format(cache))
+        return cache_storage
+    raise ValueError('Unsupported cache: {!r} (use "minidb", "dir" or a redis URI)'.format(cache))
+
+
+def benchmark_jobs(jobs, workers, cache, runs, size, change_percent):
+    """Run jobs against the fixture server several times, returns a dict with the results of each run"""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+
+    results = []
+    with FixtureServer(size, change_percent) as server, tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = open_cache(cache, tmpdir)
+        urlwatcher = types.SimpleNamespace(
+            urlwatch_config=types.SimpleNamespace(tags=False, idx_set=frozenset(), joblist=[]),
+            config_storage=types.SimpleNamespace(config=config),
+            cache_storage=cache_storage,
+            jobs=[UrlJob(url='{}/page/{}'.format(server.url, idx)) for idx in range(jobs)],
+            should_run=lambda idx, job: True,
+        )
+
+        max_workers = worker.MAX_WORKERS
+        worker.MAX_WORKERS = workers
+        try:
+            for run in range(runs):
+                server.run = run
+                urlwatcher.report = Report(urlwatcher)
+
+                start = time.perf_counter()
+                worker.run_jobs(urlwatcher)
+                duration = time.perf_counter() - start
+
+                job_states = urlwatcher.report.job_states
+                latencies = [job_state.stats['retrieve']['wall'] for job_state in job_states
+                             if 'retrieve' in job_state.stats]
+                results.append({
+                    'run': run,
+                    'duration': duration,
+                    'jobs_per_second': len(job_states) / duration,
+                    'verbs': {verb: sum(job_state.verb == verb for job_state in job_states)
+                              for verb in ('new', 'changed', 'unchanged', 'error')},
+                    'latency': dict(percentiles(latencies), max=max(latencies, default=None)),
+                    'cache_size': cache_storage.get_size(),
+                    'peak_rss': peak_rss(),
+                })
+        finally:
+            worker.MAX_WORKERS = max_workers
+            if cache != 'minidb':
+                for job in urlwatcher.jobs:
+                    cache_storage.delete(job.get_guid())
+            cache_storage.close()
+
+    return {'jobs': jobs, 'workers': workers, 'cache': cache, 'size': size, 'runs': results}
+
+
+def timed_calls(func, args_list):
+    """Call func with each of the argument tuples, returns a list of the durations"""
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def benchmark_cache(cache, guids, versions, size):
+    """Fill a scratch cache with guids x versions snapshots, returns latency percentiles of each cache operation"""
+    names = ['benchmark-{}'.format(idx) for idx in range(guids)]
+    # Keep the last 10% of the history in clean() and remove 10% of the guids in gc()
+    retain_limit = max(1, versions // 10)
+    known_guids = names[:guids - guids // 10]
+
+    operations = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = open_cache(cache, tmpdir)
+        try:
+            saves = []
+            for version in range(versions):
+                # Generating the data is not part of the measurement
+                snapshots = [(None, guid, generate_html(size, '{}:{}'.format(guid, version)), version, 0)
+                             for guid in names]
+                saves.extend(timed_calls(cache_storage.save, snapshots))
+            operations['save'] = saves
+            operations['load'] = timed_calls(cache_storage.load, [(None, guid) for guid in names])
+            if hasattr(cache_storage, 'get_history_data'):
+                operations['get_history_data'] = timed_calls(cache_storage.get_history_data,
+                                                             [(guid, versions) for guid in names])
+            size_before = cache_storage.get_size()
+            operations['clean'] = timed_calls(cache_storage.clean, [(guid, retain_limit) for guid in names])
+            with contextlib.redirect_stdout(None):
+                operations['gc'] = timed_calls(cache_storage.gc, [(known_guids, 1)])
+            size_after = cache_storage.get_size()
+        finally:
+            if cache not in ('minidb', 'dir'):
+                for guid in names:
+                    cache_storage.delete(guid)
+            cache_storage.close()
+
+    return {
+        'cache': cache,
+        'guids': guids,
+        'versions': versions,
+        'size': size,
+        'cache_size': size_before,
+        'cache_size_after_gc': size_after,
+        'operations': {operation: dict(percentiles(durations), max=max(durations), total=sum(durations),
+                                       count=len(durations))
+                       for operation, durations in operations.items()},
+    }
+
+
+def format_cache_result(result):
+    yield '{} with {} guids x {} versions ({} bytes each), cache size: {} ({} after gc)'.format(
+        result['cache'], result['guids'], result['versions'], result['size'],
+        format_size(result['cache_size']), format_size(result['cache_size_after_gc']))
+    for operation, timing in result['operations'].items():
+        yield '  {:<16} {:>7} calls  p50 {:8.3f} ms  p90 {:8.3f} ms  p99 {:8.3f} ms  max {:8.3f} ms'.format(
+            operation, timing['count'], *(1000 * timing[key] for key in ('p50', 'p90', 'p99', 'max')))
+
+
+def measure_filter(kind, subfilter, data, min_time):
+    """Run a filter repeatedly for at least min_time seconds, returns operations per second and peak allocations"""
+    job_state = JobState(None, UrlJob(url='http://localhost/'))
+
+    def run():
+        return FilterBase.process(kind, copy.deepcopy(subfilter), job_state, data)
+
+    # Warm-up run (also makes sure the filter works before measuring)
+    run()
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_alloc = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    count = 0
+    start = time.perf_counter()
+    while True:
+        run()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    return count / elapsed, peak_alloc
+
+
+def benchmark_filters(kinds=None, sizes=CORPUS_SIZES, min_time=0.2):
+    """Benchmark filter kinds on corpora of the given sizes, returns a dict with the results"""
+    results = []
+    for kind in sorted(kinds or FilterBase.__subclasses__):
+        corpus, subfilter = FILTER_BENCHMARKS.get(kind, ('html', {}))
+        for size in sizes:
+            result = {'filter': kind, 'corpus': corpus, 'size': size}
+            if corpus is None:
+                result['error'] = 'No corpus for this filter'
+            else:
+                data = CORPORA[corpus](size)
+                if FilterBase.is_bytes_filter_kind(kind) and isinstance(data, str):
+                    data = data.encode()
+                try:
+                    result['ops_per_second'], result['peak_alloc'] = measure_filter(kind, subfilter, data, min_time)
+                except Exception as e:
+                    result['error'] = '{}: {}'.format(type(e).__name__, e)
+            results.append(result)
+
+    return {
+        'version': urlwatch.__version__,
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def format_filters_result(result, baseline=None):
+    previous = {}
+    if baseline is not None:
+        previous = {(entry['filter'], entry['size']): entry for entry in baseline['results']}
+
+    for entry in result['results']:
+        line = '{:<24} {:>5} {:>9}'.format(entry['filter'], entry['corpus'] or '-', format_bytes(entry['size']))
+        if 'error' in entry:
+            yield '{}  skipped ({})'.format(line, entry['error'])
+            continue
+
+        line = '{}  {:>12.1f} ops/s  {:>9} peak alloc'.format(line, entry['ops_per_second'],
+                                                              format_bytes(entry['peak_alloc']))
+        old = previous.get((entry['filter'], entry['size']), {})
+        if old.get('ops_per_second'):
+            line = '{}  {:+.1f}% vs. {}'.format(line, 100 * (entry['ops_per_second'] / old['ops_per_second'] - 1),
+                                                baseline['version'])
+        yield line
+
+
+def format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024 or unit == 'MiB':
+            return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+        size /= 1024
+
+
+def format_jobs_result(result):
+    yield '{jobs} jobs, {workers} workers, {cache} cache'.format(**result)
+    for run in result['runs']:
+        latency = run['latency']
+        yield ('  run {run}: {duration:.2f}s, {jobs_per_second:.1f} jobs/s, latency p50 {p50:.3f}s'
+               ' p90 {p90:.3f}s p99 {p99:.3f}s max {max:.3f}s, {changed} changed'.format(
+                   **dict(run, **{key: value or 0 for key, value in latency.items()}), changed=run['verbs']['changed']))
+        yield '         cache size {}, peak RSS {}'.format(format_size(run['cache_size']), format_size(run['peak_rss']))
+
+
+def format_size(size):
+    if size is None:
+        return 'n/a'
+    return '{:.1f} MiB'.format(size / 1024 / 1024)
+
+
+def comma_list(value, type=str):
+    return [type(item) for item in value.split(',') if item]
+
+
+def run_isolated(args):
+    # Each configuration runs in a separate process, so that peak RSS is measured per configuration
+    output = subprocess.check_output([sys.executable, '-m', 'urlwatch.benchmark'] + args)
+    return json.loads(output)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    jobs_parser = subparsers.add_parser('jobs', help='run url jobs against a local HTTP server')
+    jobs_parser.add_argument('--jobs', type=lambda value: comma_list(value, int), default=[100, 1000],
+                             help='comma-separated numbers of jobs (default: 100,1000)')
+    jobs_parser.add_argument('--workers', type=lambda value: comma_list(value, int), default=[worker.MAX_WORKERS],
+                             help='comma-separated numbers of worker threads (default: %(default)s)')
+    jobs_parser.add_argument('--cache', type=comma_list, default=['minidb'],
+                             help='comma-separated cache backends: "minidb" or a redis URI (use a dedicated database)')
+    jobs_parser.add_argument('--runs', type=int, default=3, help='runs per configuration (default: %(default)s)')
+    jobs_parser.add_argument('--size', type=int, default=10000, help='page size in bytes (default: %(default)s)')
+    jobs_parser.add_argument('--change', type=int, default=10,
+                             help='percentage of pages that change in each run (default: %(default)s)')
+    jobs_parser.add_argument('--json', metavar='FILE', help='write the results as JSON to FILE')
+    jobs_parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+
+    filters_parser = subparsers.add_parser('filters', help='run each filter on synthetic HTML/XML/JSON/CSV/PDF data')
+    filters_parser.add_argument('--filter', type=comma_list, help='comma-separated filter kinds (default: all)')
+    filters_parser.add_argument('--sizes', type=lambda value: comma_list(value, int), default=list(CORPUS_SIZES),
+                                help='comma-separated corpus sizes in bytes (default: 1024,65536,1048576)')
+    filters_parser.add_argument('--min-time', type=float, default=0.2,
+                                help='minimum time in seconds to run each filter (default: %(default)s)')
+    filters_parser.add_argument('--json', metavar='FILE', help='write the results as JSON to FILE')
+    filters_parser.add_argument('--compare', metavar='FILE', help='compare with results written with --json before')
+
+    cache_parser = subparsers.add_parser('cache', help='measure latencies of cache storage operations')
+    cache_parser.add_argument('--cache', type=comma_list, default=['minidb', 'dir'],
+                              help='comma-separated cache backends: "minidb", "dir" or a redis URI'
+                                   ' (use a dedicated database, default: minidb,dir)')
+    cache_parser.add_argument('--guids', type=lambda value: comma_list(value, int), default=[100, 1000],
+                              help='comma-separated numbers of jobs in the cache (default: 100,1000)')
+    cache_parser.add_argument('--versions', type=lambda value: comma_list(value, int), default=[1, 10, 50],
+                              help='comma-separated numbers of snapshots per job (default: 1,10,50)')
+    cache_parser.add_argument('--size', type=int, default=10000, help='snapshot size in bytes (default: %(default)s)')
+    cache_parser.add_argument('--json', metavar='FILE', help='write the results as JSON to FILE')
+
+    args = parser.parse_args(args)
+
+    if args.benchmark == 'cache':
+        results = []
+        for cache, guids, versions in itertools.product(args.cache, args.guids, args.versions):
+            result = benchmark_cache(cache, guids, versions, args.size)
+            for line in format_cache_result(result):
+                print(line)
+            results.append(result)
+
+        if args.json:
+            with open(args.json, 'w') as fp:
+                json.dump(results, fp, indent=2)
+        return 0
+
+    if args.benchmark == 'filters':
+        baseline = None
+        if args.compare:
+            with open(args.compare) as fp:
+                baseline = json.load(fp)
+
+        result = benchmark_filters(args.filter, args.sizes, args.min_time)
+        for line in format_filters_result(result, baseline):
+            print(line)
+
+        if args.json:
+            with open(args.json, 'w') as fp:
+                json.dump(result, fp, indent=2)
+        return 0
+
+    if args.single:
+        result = benchmark_jobs(args.jobs[0], args.workers[0], args.cache[0], args.runs, args.size, args.change)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for jobs, workers, cache in itertools.product(args.jobs, args.workers, args.cache):
+        result = run_isolated(['jobs', '--single', '--jobs', str(jobs), '--workers', str(workers), '--cache', cache,
+                               '--runs', str(args.runs), '--size', str(args.size), '--change', str(args.change)])
+        for line in format_jobs_result(result):
+            print(line)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,6 +28,7 @@
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import contextlib
 import logging
 import os
 import shutil
@@ -36,8 +37,10 @@ import requests
 import traceback
 import datetime
 
+from . import profiler, recorder
+from .daemon import Daemon
 from .filters import FilterBase
-from .handler import JobState, Report
+from .handler import JobState, Report, stats_total
 from .jobs import JobBase, UrlJob
 from .reporters import ReporterBase
 from .util import atomic_rename, edit_file, import_module_from_source
@@ -201,6 +204,33 @@ class UrlwatchCommand:
 
         return 0
 
+    def show_stats(self):
+        for idx, job in enumerate(self.urlwatcher.jobs, 1):
+            print('%d: %s' % (idx, job.pretty_name()))
+            stats = self.urlwatcher.cache_storage.get_stats(job.get_guid())
+            if not stats:
+                print('    no timing statistics recorded')
+                continue
+
+            for stage, stat in stats.items():
+                print('    {:<20} {:9.3f}s wall {:9.3f}s CPU'.format(stage, stat['wall'], stat['cpu']))
+
+            print('    {:<20} {:9.3f}s wall {:9.3f}s CPU'.format('total', *stats_total(stats)))
+        return 0
+
+    def flush_spool(self):
+        spool = self.urlwatcher.spool
+        if spool is None:
+            print('The notification spool is not enabled in the config.')
+            return 1
+
+        remaining = spool.flush(self.urlwatcher.report)
+        if remaining:
+            print('{} queued report(s) could not be delivered'.format(remaining))
+            return 1
+
+        return 0
+
     def modify_urls(self):
         save = True
         if self.urlwatch_config.delete is not None:
@@ -293,6 +323,10 @@ class UrlwatchCommand:
             sys.exit(self.dump_history(self.urlwatch_config.dump_history))
         if self.urlwatch_config.list:
             sys.exit(self.list_urls())
+        if self.urlwatch_config.stats:
+            sys.exit(self.show_stats())
+        if self.urlwatch_config.flush_spool:
+            sys.exit(self.flush_spool())
         if (self.urlwatch_config.add is not None
                 or self.urlwatch_config.delete is not None
                 or self.urlwatch_config.enable is not None
@@ -491,7 +525,18 @@ class UrlwatchCommand:
             self.check_telegram_chats()
             self.check_xmpp_login()
             self.check_test_reporter()
-            self.handle_actions()
-            self.urlwatcher.run_jobs()
+            with contextlib.ExitStack() as exit_stack:
+                # Recording/replaying also applies to --test-filter and friends
+                if self.urlwatch_config.record:
+                    exit_stack.enter_context(recorder.Recorder(self.urlwatch_config.record))
+                elif self.urlwatch_config.replay:
+                    exit_stack.enter_context(recorder.Recorder(self.urlwatch_config.replay, replay=True))
+                self.handle_actions()
+                if self.urlwatch_config.profile:
+                    exit_stack.enter_context(profiler.Profiler(self.urlwatch_config.profile))
+                if self.urlwatch_config.daemon:
+                    Daemon(self.urlwatcher).run()
+                else:
+                    self.urlwatcher.run_jobs()
         finally:
             self.urlwatcher.close()
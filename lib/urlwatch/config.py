@@ -109,6 +109,15 @@ class CommandConfig(BaseConfig):
         group.add_argument('--features', action='store_true', help='list supported jobs/filters/reporters')
         group.add_argument('--gc-cache', metavar='RETAIN_LIMIT', type=int, help='remove old cache entries, keeping the latest RETAIN_LIMIT (default: 1)',
                            nargs='?', const=1)
+        group.add_argument('--profile', metavar='FILE', help='profile the run, write pstats to FILE and collapsed stacks to FILE.collapsed')
+        group.add_argument('--stats', action='store_true', help='show time spent in each stage of the last run of each job')
+        group.add_argument('--deadline', metavar='DURATION', help='give up on jobs that are not finished DURATION (e.g. 300 or 5m) after the start of the run')
+        group.add_argument('--daemon', action='store_true', help='keep running and run each job when its interval has elapsed')
+        group.add_argument('--flush-spool', action='store_true', help='deliver queued reports from the notification spool')
+        replay_group = group.add_mutually_exclusive_group()
+        replay_group.add_argument('--record', metavar='DIR', help='record the raw responses of all jobs to DIR')
+        replay_group.add_argument('--replay', metavar='DIR', help='replay responses recorded with --record from DIR instead of retrieving them')
+        group.add_argument('--replay-reports', action='store_true', help='send reports with all enabled reporters when replaying (default: stdout only)')
 
         args = parser.parse_args(cmdline_args)
 
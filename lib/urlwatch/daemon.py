@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of urlwatch (https://thp.io/2008/urlwatch/).
+# Copyright (c) 2008-2024 Thomas Perl <m@thp.io>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import heapq
+import logging
+import os
+import signal
+import threading
+import time
+
+from . import jobs, worker
+from .handler import Report
+
+logger = logging.getLogger(__name__)
+
+# Jobs that are due within this many seconds of each other are run together in one batch (and report)
+BATCH_WINDOW = 1
+
+# Maximum time (in seconds) to sleep before checking whether the job list has changed
+RELOAD_CHECK_INTERVAL = 60
+
+
+class Daemon(object):
+    """Keep running and run each job whenever its interval has elapsed
+
+    Due times are kept in a priority queue (ordered by due time). All jobs
+    that are due are run as one batch in the worker threads and reported
+    together. The job list is reloaded when the jobs file is modified.
+    """
+
+    def __init__(self, urlwatcher):
+        self.urlwatcher = urlwatcher
+        self.default_interval = jobs.parse_interval(
+            urlwatcher.config_storage.config.get('daemon', {}).get('interval', 3600))
+        self.checked_timestamps = None
+        self.stopped = threading.Event()
+
+        # Heap of (due time, guid), an entry is stale if the guid is due at another time (or not anymore)
+        self.queue = []
+        self.due = {}
+        self.jobs = {}
+        self.urls_mtime = None
+
+    def _jobs_file_mtime(self):
+        try:
+            return os.path.getmtime(self.urlwatcher.urlwatch_config.urls)
+        except OSError:
+            return None
+
+    def schedule(self, guid, due):
+        self.due[guid] = due
+        heapq.heappush(self.queue, (due, guid))
+
+    def sync_jobs(self, now):
+        """Update the queue from the current job list (new jobs are due after their last run, if any)"""
+        self.urls_mtime = self._jobs_file_mtime()
+        self.jobs = {job.get_guid(): job for job in worker.select_jobs(self.urlwatcher)}
+
+        for guid in list(self.due):
+            if guid not in self.jobs:
+                del self.due[guid]
+
+        if self.checked_timestamps is None:
+            # Only needed at startup, afterwards the daemon knows when the jobs ran
+            self.checked_timestamps = self.urlwatcher.cache_storage.get_checked_timestamps()
+
+        for guid, job in self.jobs.items():
+            if guid not in self.due:
+                checked = self.checked_timestamps.get(guid)
+                self.schedule(guid, now if checked is None else max(now, checked + self.get_interval(job, now)))
+
+        logger.info('Scheduling %d jobs', len(self.jobs))
+
+    def get_interval(self, job, now):
+        return self.urlwatcher.get_job_interval(job, self.default_interval, now)
+
+    def reload_jobs_if_changed(self, now):
+        mtime = self._jobs_file_mtime()
+        if mtime != self.urls_mtime:
+            logger.info('Jobs file changed, reloading jobs')
+            try:
+                self.urlwatcher.load_jobs()
+                self.sync_jobs(now)
+            except Exception:
+                # Keep running the previous jobs, the file is reloaded when it is changed again
+                logger.exception('Could not reload jobs, keeping the previous jobs')
+                self.urls_mtime = mtime
+
+    def pop_due_jobs(self, now):
+        due_jobs = []
+        while self.queue and self.queue[0][0] <= now + BATCH_WINDOW:
+            due, guid = heapq.heappop(self.queue)
+            if self.due.get(guid) == due:
+                due_jobs.append(self.jobs[guid])
+        return due_jobs
+
+    def run_batch(self, due_jobs):
+        start = time.time()
+        logger.info('Running %d due jobs', len(due_jobs))
+
+        self.urlwatcher.report = Report(self.urlwatcher)
+        try:
+            self.urlwatcher.run_jobs(due_jobs)
+        except Exception:
+            # Keep the daemon running, the jobs are tried again after their interval
+            logger.exception('Error while running jobs')
+
+        for job_state in self.urlwatcher.report.job_states:
+            if job_state.verb == 'changed':
+                self.urlwatcher.job_changed(job_state.job, start)
+
+        for job in due_jobs:
+            self.schedule(job.get_guid(), max(start + self.get_interval(job, start), time.time()))
+
+    def next_wakeup(self, now):
+        while self.queue and self.due.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+
+        timeout = RELOAD_CHECK_INTERVAL
+        if self.queue:
+            timeout = min(timeout, max(0, self.queue[0][0] - now))
+        return timeout
+
+    def stop(self, signum=None, frame=None):
+        logger.info('Stopping daemon after the current batch')
+        self.stopped.set()
+
+    def run(self):
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, self.stop)
+
+        # Keep HTTP connections open between runs
+        jobs.http_session = jobs.create_http_session(worker.MAX_WORKERS)
+        try:
+            self.sync_jobs(time.time())
+            while not self.stopped.is_set():
+                due_jobs = self.pop_due_jobs(time.time())
+                if due_jobs:
+                    self.run_batch(due_jobs)
+
+                self.stopped.wait(self.next_wakeup(time.time()))
+                if not self.stopped.is_set():
+                    self.reload_jobs_if_changed(time.time())
+        finally:
+            jobs.http_session.close()
+            jobs.http_session = None
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
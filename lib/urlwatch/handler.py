@@ -28,6 +28,8 @@
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import base64
+import contextlib
 import datetime
 import logging
 import time
@@ -39,15 +41,40 @@ import shlex
 import subprocess
 import email.utils
 
+from . import profiler
 from .filters import FilterBase
-from .jobs import NotModifiedError
+from .jobs import JobBase, JobTimeoutError, NotModifiedError, parse_interval
 from .reporters import ReporterBase
 
 logger = logging.getLogger(__name__)
 
 
+def serialize_data(data):
+    # Binary job data (e.g. from a filter that returns bytes) is not JSON-serializable
+    if isinstance(data, bytes):
+        return {'type': 'bytes', 'base64': base64.b64encode(data).decode('ascii')}
+    return data
+
+
+def unserialize_data(data):
+    if isinstance(data, dict) and data.get('type') == 'bytes':
+        return base64.b64decode(data['base64'])
+    return data
+
+
+def stats_total(stats):
+    """Total wall clock and CPU time of all stages of a job"""
+    # The response time is already included in "retrieve"
+    stats = [stat for stage, stat in stats.items() if stage != 'response']
+    return sum(stat['wall'] for stat in stats), sum(stat['cpu'] for stat in stats)
+
+
 class JobState(object):
-    def __init__(self, cache_storage, job):
+    __slots__ = ('cache_storage', 'job', 'verb', 'old_data', 'new_data', 'history_data', 'timestamp',
+                 'current_timestamp', 'exception', 'traceback', 'tries', 'etag', 'error_ignored', 'changed',
+                 'released', 'stats', 'http_status', 'bytes_received', 'deadline', 'started', '_generated_diff')
+
+    def __init__(self, cache_storage, job, deadline=None):
         self.cache_storage = cache_storage
         self.job = job
         self.verb = None
@@ -61,6 +88,15 @@ class JobState(object):
         self.tries = 0
         self.etag = None
         self.error_ignored = False
+        self.changed = False
+        self.released = False
+        # Wall clock and CPU time (in seconds) spent in each stage of processing the job
+        self.stats = {}
+        self.http_status = None
+        self.bytes_received = None
+        # Time (time.monotonic()) by which the job must be finished, if any (see max_runtime)
+        self.deadline = deadline
+        self.started = None
         self._generated_diff = None
 
     def __enter__(self):
@@ -80,6 +116,21 @@ class JobState(object):
             # We don't want exceptions from releasing resources to override job run results
             logger.warning('Exception while releasing resources for job: %r', self.job, exc_info=True)
 
+    def add_stat(self, stage, wall, cpu=0.0):
+        stat = self.stats.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+        stat['wall'] += wall
+        stat['cpu'] += cpu
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        # Jobs are processed in their own worker thread, so the thread's CPU time is the job's CPU time
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            with profiler.stage(stage):
+                yield
+        finally:
+            self.add_stat(stage, time.perf_counter() - wall, time.thread_time() - cpu)
+
     def load(self):
         guid = self.job.get_guid()
         self.old_data, self.timestamp, self.tries, self.etag = self.cache_storage.load(self.job, guid)
@@ -93,7 +144,59 @@ class JobState(object):
             # If no new data has been retrieved due to an exception, use the old job data
             self.new_data = self.old_data
 
-        self.cache_storage.save(self.job, self.job.get_guid(), self.new_data, time.time(), self.tries, self.etag)
+        stats = self.get_stats_to_save()
+        with self.timed('save'):
+            self.cache_storage.save(self.job, self.job.get_guid(), self.new_data, time.time(), self.tries, self.etag,
+                                    stats=stats)
+
+        # The time spent saving is only known once the snapshot has been saved,
+        # it is stored with the next statistics of the job instead of writing them again
+        self.cache_storage.save_stats[self.job.get_guid()] = dict(self.stats['save'])
+
+    def get_stats_to_save(self):
+        stats = dict(self.stats)
+        save_stats = self.cache_storage.save_stats.get(self.job.get_guid())
+        if save_stats is not None:
+            stats['save'] = save_stats
+        return stats
+
+    def time_left(self):
+        """Seconds until the deadline of the job (None without deadline), raises JobTimeoutError if it has passed"""
+        if self.deadline is None:
+            return None
+
+        time_left = self.deadline - time.monotonic()
+        if time_left <= 0:
+            raise JobTimeoutError('Deadline passed before the job finished')
+        return time_left
+
+    def time_out(self):
+        """Give up on a job that did not finish before its deadline (called from the main thread)
+
+        The worker thread might still be processing the job (and writing to this
+        job state), so the timeout is saved and reported using a new job state.
+        """
+        started = self.started
+        job_state = JobState(self.cache_storage, self.job)
+        try:
+            # Keep the old data of the job when saving
+            job_state.load()
+        except Exception as e:
+            logger.warning('Could not load job %s: %s', self.job, e)
+
+        if started is None:
+            message = 'Job did not start before the deadline of the run'
+        else:
+            message = 'Job did not finish within {:.0f} seconds'.format(time.monotonic() - started)
+
+        job_state.exception = JobTimeoutError(message)
+        job_state.traceback = message
+        job_state.tries += 1
+        return job_state
+
+    def get_stats_update(self):
+        """Statistics of a run without a new snapshot (for CacheStorage.update_stats_many), including its time"""
+        return self.job.get_guid(), self.get_stats_to_save(), time.time()
 
     def process(self):
         logger.info('Processing: %s', self.job)
@@ -101,23 +204,33 @@ class JobState(object):
         if self.exception:
             return self
 
+        self.started = time.monotonic()
         try:
             try:
-                self.load()
+                max_runtime = getattr(self.job, 'max_runtime', None)
+                if max_runtime is not None:
+                    job_deadline = self.started + parse_interval(max_runtime)
+                    self.deadline = job_deadline if self.deadline is None else min(self.deadline, job_deadline)
+
+                with self.timed('load'):
+                    self.load()
 
                 if self.old_data is None and getattr(self.job, 'treat_new_as_changed', False):
                     # Force creation of a diff for "NEW"ly found items by pretending we had an empty page before
                     self.old_data = ''
                     self.timestamp = None
 
-                data = self.job.retrieve(self)
+                with self.timed('retrieve'):
+                    data = self.job.retrieve(self)
 
                 # Apply automatic filters first
-                data = FilterBase.auto_process(self, data)
+                with self.timed('filter:auto'):
+                    data = FilterBase.auto_process(self, data)
 
                 # Apply any specified filters
                 for filter_kind, subfilter in FilterBase.normalize_filter_list(self.job.filter):
-                    data = FilterBase.process(filter_kind, subfilter, self, data)
+                    with self.timed('filter:' + filter_kind):
+                        data = FilterBase.process(filter_kind, subfilter, self, data)
 
                 self.new_data = data
 
@@ -138,8 +251,88 @@ class JobState(object):
                 self.tries += 1
                 logger.debug('Increasing number of tries to %i for %s', self.tries, self.job)
 
+        if self.exception is None:
+            self.compare()
+
+        # Older snapshots are only needed for the comparison
+        self.history_data = {}
+
         return self
 
+    def compare(self):
+        if self.old_data is None:
+            return
+
+        matched_history_time = self.history_data.get(self.new_data)
+        if matched_history_time:
+            self.timestamp = matched_history_time
+        if matched_history_time or self.new_data == self.old_data:
+            self.changed = False
+            return
+
+        close_matches = difflib.get_close_matches(self.new_data, self.history_data, n=1)
+        if close_matches:
+            self.old_data = close_matches[0]
+            self.timestamp = self.history_data[close_matches[0]]
+        self.changed = True
+
+        # Generate the diff while we are still running in the worker thread,
+        # so that the reporters only have to format the result
+        try:
+            with self.timed('diff'):
+                self.get_diff()
+        except Exception:
+            # The diff will be generated again (and the error raised) when reporting
+            logger.warning('Could not generate diff for %r', self.job, exc_info=True)
+            self._generated_diff = None
+
+    def release(self, keep_data=False):
+        """Drop the page contents once the job has been saved, keeping only what is needed for reporting"""
+        self.history_data = {}
+        if keep_data or (self.verb == 'changed' and self._generated_diff is None):
+            # The diff can only be (re-)generated from the page contents
+            return
+
+        self.old_data = None
+        self.new_data = None
+        # Reporters must not treat released changed jobs as being identical
+        self.released = (self.verb == 'changed')
+
+    def serialize(self, include_data=True):
+        job = self.job.serialize()
+        if job.get('tags') is not None:
+            job['tags'] = sorted(job['tags'])
+
+        data = {'job': job, 'verb': self.verb}
+        if include_data:
+            data.update({
+                'old_data': serialize_data(self.old_data),
+                'new_data': serialize_data(self.new_data),
+                'timestamp': self.timestamp,
+                'current_timestamp': self.current_timestamp,
+                'traceback': self.traceback,
+                'released': self.released,
+                'stats': self.stats,
+            })
+        if self.verb == 'changed':
+            data['diff'] = self.get_diff()
+        return data
+
+    @classmethod
+    def unserialize(cls, data):
+        # Job states restored from serialized data cannot be processed or saved again
+        job_state = cls(None, JobBase.unserialize(data['job']))
+        job_state.verb = data['verb']
+        job_state.old_data = unserialize_data(data.get('old_data'))
+        job_state.new_data = unserialize_data(data.get('new_data'))
+        job_state.timestamp = data.get('timestamp')
+        job_state.current_timestamp = data.get('current_timestamp')
+        job_state.traceback = data.get('traceback')
+        job_state.released = data.get('released', False)
+        job_state.stats = data.get('stats', {})
+        job_state._generated_diff = data.get('diff')
+        return job_state
+
     def get_diff(self):
         if self._generated_diff is None:
             self._generated_diff = self._generate_diff()
@@ -149,22 +342,46 @@ class JobState(object):
 
         return self._generated_diff
 
+    def _run_diff_tool(self, old_file_path, new_file_path, pass_fds=()):
+        cmdline = shlex.split(self.job.diff_tool) + [old_file_path, new_file_path]
+        proc = subprocess.Popen(cmdline, stdout=subprocess.PIPE, pass_fds=pass_fds)
+        stdout, _ = proc.communicate()
+        # Diff tools return 0 for "nothing changed" or 1 for "files differ", anything else is an error
+        if proc.returncode in (0, 1):
+            return stdout.decode('utf-8')
+        else:
+            raise subprocess.CalledProcessError(proc.returncode, cmdline)
+
+    def _run_diff_tool_memfd(self):
+        # Anonymous in-memory files, passed to the diff tool as /dev/fd/N paths
+        # (unlike pipes, these can be seeked and re-opened by the diff tool)
+        fds = []
+        try:
+            for name, data in (('old_file', self.old_data), ('new_file', self.new_data)):
+                fd = os.memfd_create(name)
+                fds.append(fd)
+                with open(fd, 'wb', closefd=False) as fp:
+                    fp.write(data.encode('utf-8'))
+            old_fd, new_fd = fds
+            return self._run_diff_tool('/dev/fd/%d' % old_fd, '/dev/fd/%d' % new_fd, pass_fds=fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _run_diff_tool_tempfile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            old_file_path = os.path.join(tmpdir, 'old_file')
+            new_file_path = os.path.join(tmpdir, 'new_file')
+            with open(old_file_path, 'w+b') as old_file, open(new_file_path, 'w+b') as new_file:
+                old_file.write(self.old_data.encode('utf-8'))
+                new_file.write(self.new_data.encode('utf-8'))
+            return self._run_diff_tool(old_file_path, new_file_path)
+
     def _generate_diff(self):
         if self.job.diff_tool is not None:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                old_file_path = os.path.join(tmpdir, 'old_file')
-                new_file_path = os.path.join(tmpdir, 'new_file')
-                with open(old_file_path, 'w+b') as old_file, open(new_file_path, 'w+b') as new_file:
-                    old_file.write(self.old_data.encode('utf-8'))
-                    new_file.write(self.new_data.encode('utf-8'))
-                cmdline = shlex.split(self.job.diff_tool) + [old_file_path, new_file_path]
-                proc = subprocess.Popen(cmdline, stdout=subprocess.PIPE)
-                stdout, _ = proc.communicate()
-                # Diff tools return 0 for "nothing changed" or 1 for "files differ", anything else is an error
-                if proc.returncode in (0, 1):
-                    return stdout.decode('utf-8')
-                else:
-                    raise subprocess.CalledProcessError(proc.returncode, cmdline)
+            if hasattr(os, 'memfd_create') and os.path.isdir('/dev/fd'):
+                return self._run_diff_tool_memfd()
+            return self._run_diff_tool_tempfile()
 
         timestamp_old = email.utils.formatdate(self.timestamp, localtime=True)
         timestamp_new = email.utils.formatdate(self.current_timestamp or time.time(), localtime=True)
@@ -175,11 +392,20 @@ class JobState(object):
 
 class Report(object):
     def __init__(self, urlwatch_config):
-        self.config = urlwatch_config.config_storage.config
+        # The config with the reporters to use for this run (see Urlwatch.report_config)
+        self.config = getattr(urlwatch_config, 'report_config', urlwatch_config.config_storage.config)
+        self.cache_storage = getattr(urlwatch_config, 'cache_storage', None)
+        self.spool = getattr(urlwatch_config, 'spool', None)
 
         self.job_states = []
         self.start = datetime.datetime.now()
 
+        # Names of the reporters that get each job as soon as it is finished
+        self.streamed = None
+
+        # All jobs finished in this run, including those that are not reported (e.g. retried errors)
+        self.finished_job_states = []
+
     def _result(self, verb, job_state):
         if job_state.exception is not None:
             logger.debug('Got exception while processing %r', job_state.job, exc_info=job_state.exception)
@@ -199,6 +425,30 @@ class Report(object):
     def error(self, job_state):
         self._result('error', job_state)
 
+    def job_finished(self, job_state):
+        """Submit a finished (and saved) job to incremental reporters, and release data that is no longer needed"""
+        self.finished_job_states.append(job_state)
+        if self.streamed is None:
+            self.streamed = ReporterBase.incremental_reporters(self)
+
+        if job_state.verb is not None:
+            duration = datetime.datetime.now() - self.start
+            for name in self.streamed:
+                try:
+                    reporter = ReporterBase.__subclasses__[name]
+                    with profiler.stage('report'):
+                        reporter(self, self.config['report'][name], [job_state], duration).submit()
+                except Exception:
+                    logger.exception('Reporter %s failed for %r', name, job_state.job)
+
+        # Unchanged jobs are shown with their contents, changed jobs only need the diff
+        # (except for the HTML table diff, which is generated from the page contents)
+        shown = (job_state.verb is not None
+                 and not set(self.streamed) >= set(ReporterBase.enabled_reporters(self))
+                 and any(self.get_filtered_job_states([job_state])))
+        job_state.release(keep_data=shown and (job_state.verb == 'unchanged' or (
+            job_state.verb == 'changed' and self.config['report']['html']['diff'] == 'table')))
+
     def get_filtered_job_states(self, job_states):
         for job_state in job_states:
             if not any(job_state.verb == verb and not self.config['display'][verb]
@@ -214,7 +464,15 @@ class Report(object):
         end = datetime.datetime.now()
         duration = (end - self.start)
 
-        ReporterBase.submit_all(self, self.job_states, duration)
+        names = None
+        if self.streamed:
+            names = [name for name in ReporterBase.enabled_reporters(self) if name not in self.streamed]
+
+        with profiler.stage('report'):
+            if self.spool is not None:
+                self.spool.submit(self, self.job_states, duration, names)
+            else:
+                ReporterBase.submit_all(self, self.job_states, duration, names)
 
     def finish_one(self, name):
         end = datetime.datetime.now()
@@ -30,9 +30,12 @@
 
 import email.utils
 import hashlib
+import http.cookiejar
 import logging
 import os
 import re
+import signal
+import statistics
 import subprocess
 import textwrap
 from typing import Iterable, Optional, Set, FrozenSet, Sequence
@@ -42,6 +45,7 @@ from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 import urlwatch
 
+from . import recorder
 from .filters import FilterBase
 from .util import TrackSubClasses
 
@@ -49,6 +53,60 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# Pooled HTTP session of a long-running process (see --daemon), otherwise each request uses a new session
+http_session = None
+
+# Fraction of the expected time until the next change used as interval of adaptive jobs (see max_interval)
+ADAPTIVE_FACTOR = 0.5
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+
+def parse_interval(value):
+    """Parse an interval in seconds (e.g. 90) or with a unit (e.g. "30m", "1.5h", "1d"), returns seconds"""
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            seconds = value
+        elif value.strip()[-1:].lower() in INTERVAL_UNITS:
+            seconds = float(value.strip()[:-1]) * INTERVAL_UNITS[value.strip()[-1].lower()]
+        else:
+            seconds = float(value)
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid interval: {!r}'.format(value))
+
+    if seconds <= 0:
+        raise ValueError('Interval must be positive: {!r}'.format(value))
+    return seconds
+
+
+def adapt_interval(interval, max_interval, changes, now):
+    """Widen the interval of a job between interval and max_interval, based on the timestamps of its changes
+
+    The job is checked twice as often as it changed recently (the median time
+    between its recent changes), but no less often than twice as often as the
+    time since its last change, so that it snaps back to short intervals
+    right after a change.
+    """
+    if not changes:
+        return interval
+
+    expected = now - changes[-1]
+    gaps = [later - earlier for earlier, later in zip(changes, changes[1:])]
+    if gaps:
+        expected = min(expected, statistics.median(gaps))
+
+    return max(interval, min(max_interval, expected * ADAPTIVE_FACTOR))
+
+
+def create_http_session(pool_size):
+    """Create a session with a connection pool, that shares no cookies between jobs"""
+    session = requests.Session()
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
 class ShellError(Exception):
     """Exception for shell commands with non-zero exit code"""
@@ -77,6 +135,11 @@ class NotModifiedError(Exception):
     ...
 
 
+class JobTimeoutError(Exception):
+    """Exception raised when a job does not finish within its max_runtime or the deadline of the run"""
+    ...
+
+
 class JobBase(object, metaclass=TrackSubClasses):
     __subclasses__ = {}
 
@@ -197,7 +260,8 @@ class JobBase(object, metaclass=TrackSubClasses):
 
 class Job(JobBase):
     __required__ = ()
-    __optional__ = ('name', 'filter', 'max_tries', 'diff_tool', 'compared_versions', 'diff_filter', 'enabled', 'treat_new_as_changed', 'user_visible_url', 'tags')
+    __optional__ = ('name', 'filter', 'max_tries', 'diff_tool', 'compared_versions', 'diff_filter', 'enabled', 'treat_new_as_changed', 'user_visible_url', 'tags',
+                    'interval', 'max_interval', 'priority', 'max_runtime')
 
     def matching_tags(self, tags: Set[str]) -> Set[str]:
         if self.tags is None:
@@ -214,6 +278,12 @@ class Job(JobBase):
     def is_enabled(self):
         return self.enabled is None or self.enabled
 
+    def get_interval(self, default=None):
+        return parse_interval(self.interval) if self.interval is not None else default
+
+    def get_max_interval(self):
+        return parse_interval(self.max_interval) if self.max_interval is not None else None
+
     @property
     def tags(self) -> Optional[FrozenSet[str]]:
         return self._tags
@@ -259,9 +329,30 @@ class ShellJob(Job):
         else:
             raise ValueError('Invalid value for "stderr": %s' % (self.stderr,))
 
-        process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=stderr, shell=True)
-        stdout_data, stderr_data = process.communicate()
-        result = process.wait()
+        timeout = job_state.time_left()
+
+        def run_command():
+            # With a timeout, run the command in its own process group, so that all its processes can be killed
+            process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=stderr, shell=True,
+                                       start_new_session=timeout is not None and hasattr(os, 'killpg'))
+            try:
+                stdout_data, stderr_data = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                if hasattr(os, 'killpg'):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                process.communicate()
+                raise JobTimeoutError('Command killed after running for {:.0f} seconds'.format(timeout))
+            return process.wait(), stdout_data, stderr_data
+
+        result, stdout_data, stderr_data = recorder.retrieve(self, run_command, lambda result: {
+            'returncode': result[0],
+            'stdout': recorder.encode_bytes(result[1]),
+            'stderr': recorder.encode_bytes(result[2]),
+        }, lambda entry: (entry['returncode'], recorder.decode_bytes(entry['stdout']),
+                          recorder.decode_bytes(entry['stderr'])))
+
         if result != 0:
             raise ShellError(result, stdout_data, stderr_data, self.stderr)
         elif self.stderr == 'fail' and stderr_data:
@@ -302,10 +393,11 @@ class UrlJob(Job):
             'https': os.getenv('HTTPS_PROXY'),
         }
 
-        if job_state.etag is not None:
+        # When recording, always request the full page, so that it can be replayed later
+        if job_state.etag is not None and not recorder.is_recording():
             headers['If-None-Match'] = job_state.etag
 
-        if job_state.timestamp is not None:
+        if job_state.timestamp is not None and not recorder.is_recording():
             headers['If-Modified-Since'] = email.utils.formatdate(job_state.timestamp)
 
         if self.ignore_cached or job_state.tries > 0:
@@ -346,14 +438,25 @@ class UrlJob(Job):
         else:
             timeout = self.timeout
 
-        response = requests.request(url=self.url,
-                                    data=self.data,
-                                    headers=headers,
-                                    method=self.method,
-                                    verify=(not self.ssl_no_verify),
-                                    cookies=self.cookies,
-                                    proxies=proxies,
-                                    timeout=timeout)
+        time_left = job_state.time_left()
+        if time_left is not None:
+            timeout = time_left if timeout is None else min(timeout, time_left)
+
+        request = http_session.request if http_session is not None else requests.request
+        response = recorder.retrieve(self, lambda: request(url=self.url,
+                                                           data=self.data,
+                                                           headers=headers,
+                                                           method=self.method,
+                                                           verify=(not self.ssl_no_verify),
+                                                           cookies=self.cookies,
+                                                           proxies=proxies,
+                                                           timeout=timeout),
+                                     recorder.response_to_dict, recorder.response_from_dict)
+
+        # Time from sending the request until the response headers arrived (including DNS lookup and connect)
+        job_state.add_stat('response', response.elapsed.total_seconds())
+        job_state.http_status = response.status_code
+        job_state.bytes_received = len(response.content)
 
         response.raise_for_status()
         if response.status_code == requests.codes.not_modified:
@@ -441,6 +544,15 @@ class BrowserJob(Job):
         self.navigate = location
 
     def retrieve(self, job_state):
+        return recorder.retrieve(self, lambda: self._retrieve_page(job_state), lambda content: {'content': content},
+                                 lambda entry: entry['content'])
+
+    def _get_timeout(self, job_state):
+        # Playwright timeouts are in milliseconds (None uses the default timeout)
+        time_left = job_state.time_left()
+        return time_left * 1000 if time_left is not None else None
+
+    def _retrieve_page(self, job_state):
         from playwright.sync_api import sync_playwright
         with sync_playwright() as playwright:
             browser = playwright[self.browser or "chromium"].launch()
@@ -451,10 +563,11 @@ class BrowserJob(Job):
                 # Pyppetteer -> Playwright migration
                 self.wait_until = 'networkidle'
 
-            page.goto(self.navigate, wait_until=self.wait_until)
+            # Launching the browser and loading the page take time, so the time left is checked before each step
+            page.goto(self.navigate, wait_until=self.wait_until, timeout=self._get_timeout(job_state))
 
             if self.wait_for:
                 locator = page.locator(self.wait_for)
-                locator.wait_for()
+                locator.wait_for(timeout=self._get_timeout(job_state))
 
             return page.content()
@@ -46,9 +46,18 @@ logger = logging.getLogger(__name__)
 
 
 class Mailer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def send(self, msg):
         raise NotImplementedError
 
+    def close(self):
+        ...
+
     def msg_plain(self, from_email, to_email, reply_to_email, subject, body):
         msg = email.mime.text.MIMEText(body, 'plain', 'utf-8')
         msg['Subject'] = subject
@@ -83,28 +92,59 @@ class SMTPMailer(Mailer):
         self.tls = tls
         self.auth = auth
         self.insecure_password = insecure_password
+        self._password = None
+        self._smtp = None
 
-    def send(self, msg):
-        s = smtplib.SMTP(self.smtp_server, self.smtp_port)
-        s.ehlo()
-
-        if self.tls:
-            s.starttls()
-
-        if self.auth:
+    def _get_password(self):
+        if self._password is None:
             if self.insecure_password:
-                passwd = self.insecure_password
+                self._password = self.insecure_password
             elif keyring is not None:
-                passwd = keyring.get_password(self.smtp_server, self.smtp_user)
-                if passwd is None:
+                self._password = keyring.get_password(self.smtp_server, self.smtp_user)
+                if self._password is None:
                     raise ValueError('No password available in keyring for {}, {}'
                                      .format(self.smtp_server, self.smtp_user))
             else:
                 raise ValueError('SMTP auth is enabled, but insecure_password is not set and keyring is not available')
-            s.login(self.smtp_user, passwd)
 
-        s.sendmail(msg['From'], msg['To'].split(','), msg.as_string(maxheaderlen=78))
-        s.quit()
+        return self._password
+
+    def _connect(self):
+        if self._smtp is None:
+            s = smtplib.SMTP(self.smtp_server, self.smtp_port)
+            try:
+                s.ehlo()
+
+                if self.tls:
+                    s.starttls()
+
+                if self.auth:
+                    s.login(self.smtp_user, self._get_password())
+            except Exception:
+                s.close()
+                raise
+
+            self._smtp = s
+
+        return self._smtp
+
+    def send(self, msg):
+        # The SMTP session is kept open for sending more messages until close() is called
+        from_addr, to_addrs, body = msg['From'], msg['To'].split(','), msg.as_string(maxheaderlen=78)
+        try:
+            self._connect().sendmail(from_addr, to_addrs, body)
+        except smtplib.SMTPServerDisconnected:
+            logger.info('SMTP connection to %s closed, reconnecting', self.smtp_server)
+            self._smtp = None
+            self._connect().sendmail(from_addr, to_addrs, body)
+
+    def close(self):
+        if self._smtp is not None:
+            s, self._smtp = self._smtp, None
+            try:
+                s.quit()
+            except smtplib.SMTPServerDisconnected:
+                pass
 
 
 class SendmailMailer(Mailer):
@@ -28,15 +28,23 @@
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import copy
 import logging
 import os
+import time
 
 from .handler import Report
+from .jobs import adapt_interval
+from .spool import NotificationSpool
 from .worker import run_jobs
 from .util import import_module_from_source
 
 logger = logging.getLogger(__name__)
 
+# Jobs with an interval are run if at most this fraction of the interval (or MAX_DUE_TOLERANCE seconds) is left
+DUE_TOLERANCE = 0.1
+MAX_DUE_TOLERANCE = 60
+
 
 class Urlwatch(object):
     def __init__(self, urlwatch_config, config_storage, cache_storage, urls_storage):
@@ -51,8 +59,11 @@ class Urlwatch(object):
         self.cache_storage = cache_storage
         self.urls_storage = urls_storage
 
+        self.spool = self.open_spool()
         self.report = Report(self)
         self.jobs = None
+        self.checked_timestamps = None
+        self.change_timestamps = None
 
         self.check_directories()
 
@@ -68,20 +79,106 @@ class Urlwatch(object):
         if hasattr(self.urlwatch_config, 'migrate_urls'):
             self.urlwatch_config.migrate_cache(self)
 
+    def is_replay_without_reports(self):
+        # Replaying recorded responses must not send real notifications, unless asked to
+        return bool(getattr(self.urlwatch_config, 'replay', None)) and not getattr(self.urlwatch_config, 'replay_reports', False)
+
+    @property
+    def report_config(self):
+        config = self.config_storage.config
+        if not self.is_replay_without_reports():
+            return config
+
+        # Only report to the console
+        config = copy.deepcopy(config)
+        for name, reporter_config in config.get('report', {}).items():
+            if name != 'stdout' and isinstance(reporter_config, dict) and 'enabled' in reporter_config:
+                reporter_config['enabled'] = False
+        return config
+
+    def open_spool(self):
+        config = self.config_storage.config.get('spool', {})
+        if not config.get('enabled', False) or self.is_replay_without_reports():
+            return None
+
+        filename = config.get('path')
+        if not filename:
+            cache = self.urlwatch_config.cache
+            if any(cache.startswith(prefix) for prefix in ('redis://', 'rediss://')):
+                filename = os.path.join(self.urlwatch_config.urlwatch_dir, 'spool.db')
+            else:
+                filename = os.path.join(os.path.dirname(cache), 'spool.db')
+
+        logger.info('Using %s as notification spool', filename)
+        return NotificationSpool(os.path.expanduser(filename), max_tries=config.get('max_tries', 10),
+                                 flush=config.get('flush', True), flush_timeout=config.get('flush_timeout', 60))
+
     def should_run(self, idx, job):
         if not job.is_enabled():
             return False
 
         # Tag mode and tag(s) were specified
         if self.urlwatch_config.tags and self.urlwatch_config.tag_set:
-            return job.matching_tags(self.urlwatch_config.tag_set)
+            return job.matching_tags(self.urlwatch_config.tag_set) and self.is_due(job)
 
-        # Index mode and index(es) were specified
+        # Index mode and index(es) were specified (always run the selected jobs)
         if not self.urlwatch_config.tags and self.urlwatch_config.idx_set:
             return idx in self.urlwatch_config.idx_set
 
         # Either mode, and no jobs were specified
-        return True
+        return self.is_due(job)
+
+    def get_job_interval(self, job, default=None, now=None):
+        try:
+            job = job.with_defaults(self.config_storage.config)
+            interval = job.get_interval(default)
+            max_interval = job.get_max_interval()
+        except ValueError as e:
+            logger.error('%s, ignoring interval of %s', e, job.get_location())
+            return default
+
+        if max_interval is None:
+            return interval
+
+        if self.change_timestamps is None:
+            # Loaded once for all jobs
+            self.change_timestamps = self.cache_storage.get_change_timestamps()
+
+        changes = self.change_timestamps.get(job.get_guid(), [])
+        interval = adapt_interval(interval or 0, max_interval, changes, now or time.time())
+        logger.debug('Adaptive interval of %s is %d seconds', job.get_location(), interval)
+        return interval
+
+    def job_changed(self, job, timestamp):
+        """Remember the change of a job, to shorten its adaptive interval"""
+        if self.change_timestamps is not None:
+            self.change_timestamps.setdefault(job.get_guid(), []).append(timestamp)
+
+    def is_due(self, job, now=None):
+        """Check if the interval of a job has elapsed since its last run (jobs without interval are always due)"""
+        # In daemon mode, the daemon takes care of the intervals
+        if getattr(self.urlwatch_config, 'daemon', False):
+            return True
+
+        interval = self.get_job_interval(job, now=now)
+        if interval is None:
+            return True
+
+        if self.checked_timestamps is None:
+            # Loaded once for all jobs
+            self.checked_timestamps = self.cache_storage.get_checked_timestamps()
+
+        checked = self.checked_timestamps.get(job.get_guid())
+        if checked is None:
+            return True
+
+        # Run jobs slightly early, so that they are not skipped due to jitter of the cron schedule
+        tolerance = min(interval * DUE_TOLERANCE, MAX_DUE_TOLERANCE)
+        due = (now or time.time()) >= checked + interval - tolerance
+        if not due:
+            logger.info('Skipping %s, next run due in %d seconds', job.get_location(),
+                        checked + interval - (now or time.time()))
+        return due
 
     def check_directories(self):
         if not os.path.exists(self.urlwatch_config.config):
@@ -105,9 +202,11 @@ class Urlwatch(object):
 
         self.jobs = jobs
 
-    def run_jobs(self):
-        run_jobs(self)
+    def run_jobs(self, jobs=None):
+        run_jobs(self, jobs)
         self.report.finish()
 
     def close(self):
         self.cache_storage.close()
+        if self.spool is not None:
+            self.spool.close()
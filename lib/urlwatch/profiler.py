@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of urlwatch (https://thp.io/2008/urlwatch/).
+# Copyright (c) 2008-2024 Thomas Perl <m@thp.io>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import collections
+import contextlib
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Processing stages (as recorded in the job statistics) and the stage of the profile they are counted in
+STAGES = {
+    'load': 'storage',
+    'save': 'storage',
+    'retrieve': 'fetch',
+    'filter': 'filter',
+    'diff': 'diff',
+}
+
+# Interval (in seconds) in which the stacks of all threads are sampled
+SAMPLE_INTERVAL = 0.005
+
+# Since Python 3.12, cProfile uses sys.monitoring and profiles all threads at once
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+# The profiler of the current run, if any
+active = None
+
+
+def stage(name):
+    """Count everything that runs in the current thread as part of the given stage"""
+    if active is None:
+        return contextlib.nullcontext()
+
+    return active.stage(STAGES.get(name.split(':', 1)[0], name))
+
+
+class Profiler(object):
+    """Profile all threads of a run
+
+    Function timings of all threads are collected with cProfile, and the
+    stacks of all threads are sampled to break down the time per stage
+    and to write a collapsed-stack (flame graph) file.
+    """
+
+    def __init__(self, filename, top=10):
+        self.filename = filename
+        self.top = top
+        self.profiles = []
+        self.samples = collections.Counter()
+        self._local = threading.local()
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._main = None
+
+    def __enter__(self):
+        global active
+        active = self
+
+        if not PER_THREAD_PROFILES:
+            self.profiles.append(cProfile.Profile())
+            self.profiles[0].enable()
+
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        self._main = self.stage('main')
+        self._main.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global active
+        self._main.__exit__(exc_type, exc_value, traceback)
+        active = None
+
+        self._stopped.set()
+        self._sampler.join()
+        if not PER_THREAD_PROFILES:
+            self.profiles[0].disable()
+
+        self.write()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        profile = None
+        if PER_THREAD_PROFILES and not stack:
+            profile = self._local.__dict__.get('profile')
+            if profile is None:
+                profile = self._local.profile = cProfile.Profile()
+                with self._lock:
+                    self.profiles.append(profile)
+            profile.enable()
+
+        ident = threading.get_ident()
+        stack.append(name)
+        self._stages[ident] = name
+        try:
+            yield
+        finally:
+            stack.pop()
+            if stack:
+                self._stages[ident] = stack[-1]
+            else:
+                self._stages.pop(ident, None)
+            if profile is not None:
+                profile.disable()
+
+    def _sample(self):
+        sampler = threading.get_ident()
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                name = self._stages.get(ident)
+                if ident == sampler or name is None:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(name)
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def get_stats(self):
+        stats = None
+        for profile in self.profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def summary(self):
+        """Top functions of each stage, by the time (estimated from samples) spent in them"""
+        totals = collections.Counter()
+        functions = collections.defaultdict(collections.Counter)
+        for stack, count in self.samples.items():
+            name, *frames = stack.split(';')
+            totals[name] += count
+            for frame in set(frames):
+                functions[name][frame] += count
+
+        result = []
+        for name in ('fetch', 'filter', 'diff', 'storage', 'report', 'job', 'main'):
+            if not totals[name]:
+                continue
+
+            result.append('{}: {:.3f}s'.format(name, totals[name] * SAMPLE_INTERVAL))
+            for frame, count in functions[name].most_common(self.top):
+                result.append('  {:9.3f}s {:5.1f}%  {}'.format(count * SAMPLE_INTERVAL, 100 * count / totals[name], frame))
+            result.append('')
+        return '\n'.join(result)
+
+    def write(self):
+        stats = self.get_stats()
+        if stats is not None:
+            stats.dump_stats(self.filename)
+            logger.info('Wrote profile to %s', self.filename)
+
+        with open(self.filename + '.collapsed', 'w') as fp:
+            for stack, count in sorted(self.samples.items()):
+                fp.write('{} {}\n'.format(stack, count))
+        logger.info('Wrote collapsed stacks to %s.collapsed', self.filename)
+
+        print(self.summary(), file=sys.stderr)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of urlwatch (https://thp.io/2008/urlwatch/).
+# Copyright (c) 2008-2024 Thomas Perl <m@thp.io>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import base64
+import datetime
+import json
+import logging
+import os
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .util import atomic_rename
+
+logger = logging.getLogger(__name__)
+
+# The recorder of the current run, if any
+active = None
+
+
+class ReplayError(Exception):
+    """Raised when a job has no recorded response to replay"""
+
+
+def is_recording():
+    return active is not None and not active.replay
+
+
+def retrieve(job, fetch, to_dict, from_dict):
+    """Call fetch() to do the I/O of a job, or record/replay its result
+
+    to_dict() converts the result of fetch() to a JSON-serializable dict for
+    the archive, from_dict() converts an archived dict back to a result.
+    """
+    if active is None:
+        return fetch()
+
+    if active.replay:
+        return from_dict(active.load(job))
+
+    result = fetch()
+    active.save(job, to_dict(result))
+    return result
+
+
+def encode_bytes(data):
+    return base64.b64encode(data).decode('ascii') if data is not None else None
+
+
+def decode_bytes(data):
+    return base64.b64decode(data) if data is not None else None
+
+
+def response_to_dict(response):
+    return {
+        'url': response.url,
+        'status_code': response.status_code,
+        'reason': response.reason,
+        'headers': dict(response.headers),
+        'content': encode_bytes(response.content),
+    }
+
+
+def response_from_dict(entry):
+    response = requests.Response()
+    response.url = entry['url']
+    response.status_code = entry['status_code']
+    response.reason = entry['reason']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response._content = decode_bytes(entry['content'])
+    # Like requests does for real responses (the job's "encoding" setting still takes precedence)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    # Replayed responses arrive instantly
+    response.elapsed = datetime.timedelta(0)
+    return response
+
+
+class Recorder(object):
+    """Archive of raw job results (one JSON file per job) to record to or replay from"""
+
+    def __init__(self, dirname, replay=False):
+        self.dirname = dirname
+        self.replay = replay
+
+        if not replay and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def __enter__(self):
+        global active
+        active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global active
+        active = None
+
+    def _get_filename(self, job):
+        return os.path.join(self.dirname, job.get_guid() + '.json')
+
+    def load(self, job):
+        try:
+            with open(self._get_filename(job)) as fp:
+                entry = json.load(fp)
+        except FileNotFoundError:
+            raise ReplayError('No recorded response for {} in {}'.format(job.get_location(), self.dirname))
+
+        logger.info('Replaying response for %s recorded at %s', job.get_location(),
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['timestamp'])))
+        return entry['result']
+
+    def save(self, job, result):
+        filename = self._get_filename(job)
+        with open(filename + '.tmp', 'w') as fp:
+            json.dump({
+                'kind': job.__kind__,
+                'location': job.get_location(),
+                'timestamp': time.time(),
+                'result': result,
+            }, fp, indent=2)
+        atomic_rename(filename + '.tmp', filename)
+        logger.info('Recorded response for %s', job.get_location())
@@ -28,23 +28,29 @@
 
 
 import asyncio
+import collections
 import difflib
 import re
 import email.utils
 import itertools
+import json
 import logging
 import sys
 import time
 import html
 import functools
+import os
 import subprocess
+import threading
 
 import requests
 
 import urlwatch
+from . import profiler
 from .mailer import SMTPMailer
 from .mailer import SendmailMailer
-from .util import TrackSubClasses, chunkstring
+from .util import TrackSubClasses, atomic_rename, chunkstring, start_daemon_thread
+from .webhook import WebhookSender
 from .xmpp import XMPP
 
 try:
@@ -78,11 +84,39 @@ logger = logging.getLogger(__name__)
 # Regular expressions that match the added/removed markers of GNU wdiff output
 WDIFF_ADDED_RE = r'[{][+].*?[+][}]'
 WDIFF_REMOVED_RE = r'[\[][-].*?[-][]]'
+WDIFF_MARKER_RE = re.compile(r'[{][+]|[+][}]|[\[][-]|[-][]]')
+
+# Default time (in seconds) to wait for a reporter before giving up on it
+REPORTER_TIMEOUT = 300
+
+# Maximum number of concurrent submissions for reporters with "separate: true"
+MAX_WORKERS = 10
+
+# Held by reporters while they write to stdout, so that their output is not interleaved
+STDOUT_LOCK = threading.Lock()
+
+
+class SeparateReportError(RuntimeError):
+    """Raised when some of the separate reports (see the "separate" setting) could not be submitted"""
+
+    def __init__(self, failed, count):
+        super().__init__('{} of {} separate reports failed'.format(len(failed), count))
+        # The job states whose reports failed
+        self.failed = failed
 
 
 class ReporterBase(object, metaclass=TrackSubClasses):
     __subclasses__ = {}
 
+    # Set to False if separate reports must not be submitted concurrently (e.g. console output)
+    PARALLEL_SEPARATE = True
+
+    # Set to False if reports must not be queued in the notification spool (e.g. console output)
+    SPOOL = True
+
+    # Set to True if each job can be reported as soon as it is finished (with "incremental: true")
+    INCREMENTAL = False
+
     def __init__(self, report, config, job_states, duration):
         self.report = report
         self.config = config
@@ -98,7 +132,24 @@ class ReporterBase(object, metaclass=TrackSubClasses):
             'Support urlwatch development: https://github.com/sponsors/thp',
             'watched {count} URLs in {duration} seconds'.format(count=len(self.job_states),
                                                                 duration=self.duration.seconds),
-        )
+        ) + self.get_stats_summary()
+
+    def get_stats_summary(self):
+        if not self.get_base_config(self.report).get('stats', False):
+            return ()
+
+        # Total wall clock time per stage, with all filters counted as "filter"
+        totals = collections.defaultdict(float)
+        for job_state in self.job_states:
+            for stage, stat in job_state.stats.items():
+                if stage != 'response':
+                    totals[stage.split(':', 1)[0]] += stat['wall']
+
+        if not totals:
+            return ()
+
+        return ('time spent in {}'.format(', '.join('{} {:.2f}s'.format(stage, wall)
+                                                    for stage, wall in totals.items())),)
 
     def convert(self, othercls):
         if hasattr(othercls, '__kind__'):
@@ -121,37 +172,108 @@ class ReporterBase(object, metaclass=TrackSubClasses):
             ))
         return '\n'.join(result)
 
+    @classmethod
+    def _submit_reporter(cls, name, report, cfg, job_states, duration):
+        base_config = cls.get_base_config(report)
+        if not base_config.get('separate', False):
+            cls(report, cfg, job_states, duration).submit()
+            return
+
+        pending = collections.deque(job_states)
+        failed = []
+
+        def submit_separate():
+            while True:
+                try:
+                    job_state = pending.popleft()
+                except IndexError:
+                    return
+
+                try:
+                    with profiler.stage('report'):
+                        cls(report, cfg, [job_state], duration).submit()
+                except Exception:
+                    logger.exception('Reporter %s failed for %r', name, job_state.job)
+                    failed.append(job_state)
+
+        if not cls.PARALLEL_SEPARATE:
+            submit_separate()
+        else:
+            threads = [start_daemon_thread(submit_separate) for _ in range(min(MAX_WORKERS, len(job_states)))]
+            for thread in threads:
+                thread.join()
+
+        if failed:
+            raise SeparateReportError(failed, len(job_states))
+
+    @classmethod
+    def enabled_reporters(cls, report):
+        return [name for name in cls.__subclasses__ if report.config['report'].get(name, {}).get('enabled', False)]
+
+    @classmethod
+    def incremental_reporters(cls, report):
+        return [name for name in cls.enabled_reporters(report)
+                if cls.__subclasses__[name].INCREMENTAL and report.config['report'][name].get('incremental', False)]
+
     @classmethod
     def submit_one(cls, name, report, job_states, duration):
-        subclass = cls.__subclasses__[name]
         cfg = report.config['report'].get(name, {'enabled': False})
         if cfg['enabled']:
-            base_config = subclass.get_base_config(report)
-            if base_config.get('separate', False):
-                for job_state in job_states:
-                    subclass(report, cfg, [job_state], duration).submit()
-            else:
-                subclass(report, cfg, job_states, duration).submit()
+            cls.__subclasses__[name]._submit_reporter(name, report, cfg, job_states, duration)
         else:
             raise ValueError('Reporter not enabled: {name}'.format(name=name))
 
     @classmethod
-    def submit_all(cls, report, job_states, duration):
-        any_enabled = False
-        for name, subclass in cls.__subclasses__.items():
+    def submit_parallel(cls, report, submissions, timeout=None, failed=None):
+        """Submit a list of (name, job_states, duration) in parallel, returns a list of success flags
+
+        If timeout is given (and not 0), no reporter is waited for longer than that, in addition to its own timeout.
+        If some of the separate reports of a submission failed, their job states are stored in the
+        failed dict (if given) under the index of the submission.
+        """
+        start = time.monotonic()
+        results = [False] * len(submissions)
+
+        def submit(idx, name, cfg, job_states, duration):
+            try:
+                with profiler.stage('report'):
+                    cls.__subclasses__[name]._submit_reporter(name, report, cfg, job_states, duration)
+                results[idx] = True
+            except SeparateReportError as e:
+                logger.error('Reporter %s failed: %s', name, e)
+                if failed is not None:
+                    failed[idx] = e.failed
+            except Exception:
+                logger.exception('Reporter %s failed', name)
+
+        threads = []
+        for idx, (name, job_states, duration) in enumerate(submissions):
             cfg = report.config['report'].get(name, {})
-            if cfg.get('enabled', False):
-                any_enabled = True
-                logger.info('Submitting with %s (%r)', name, subclass)
-                base_config = subclass.get_base_config(report)
-                if base_config.get('separate', False):
-                    for job_state in job_states:
-                        subclass(report, cfg, [job_state], duration).submit()
-                else:
-                    subclass(report, cfg, job_states, duration).submit()
+            logger.info('Submitting with %s (%r)', name, cls.__subclasses__[name])
+            thread = start_daemon_thread(submit, idx, name, cfg, job_states, duration, name='reporter-' + name)
+            # Like the other common settings, the timeout can be set for the base reporter (e.g. "text")
+            base_config = cls.__subclasses__[name].get_base_config(report)
+            reporter_timeout = cfg.get('timeout', base_config.get('timeout', REPORTER_TIMEOUT))
+            if timeout:
+                reporter_timeout = min(reporter_timeout, timeout) if reporter_timeout else timeout
+            threads.append((name, thread, reporter_timeout))
+
+        for name, thread, reporter_timeout in threads:
+            thread.join(max(0, start + reporter_timeout - time.monotonic()) if reporter_timeout else None)
+            if thread.is_alive():
+                logger.error('Reporter %s did not finish within %s seconds, giving up', name, reporter_timeout)
+
+        # Reporters that time out may still finish later, but count as failed
+        return list(results)
 
-        if not any_enabled:
-            logger.warning('No reporters enabled.')
+    @classmethod
+    def submit_all(cls, report, job_states, duration, names=None):
+        if names is None:
+            names = cls.enabled_reporters(report)
+            if not names:
+                logger.warning('No reporters enabled.')
+
+        return cls.submit_parallel(report, [(name, job_states, duration) for name in names])
 
     def submit(self):
         raise NotImplementedError()
@@ -232,9 +354,7 @@ class HtmlReporter(ReporterBase):
                                          location=job.get_location(),
                                          pretty_name=job.pretty_name())
 
-            content = self._format_content(job_state, cfg['diff'])
-            if content is not None:
-                yield content
+            yield from self._format_content(job_state, cfg['diff'])
 
             yield SafeHtml('<hr>')
 
@@ -246,39 +366,149 @@ class HtmlReporter(ReporterBase):
         </html>
         """)
 
-    def _diff_to_html(self, unified_diff):
-        result = unified_diff
+    def _diff_to_html(self, unified_diff, head='', tail=''):
+        """Convert a diff to HTML in a single pass, yielding one line of HTML at a time"""
         diff_mapping = {'+': 'unified_add', '-': 'unified_sub'}
+        wdiff_mapping = {'{+': ('diff_add', '+}'), '[-': ('diff_sub', '-]')}
+
+        # wdiff markers can span multiple lines, the span is closed and re-opened on each line
+        wdiff_class, wdiff_closing = None, None
+
+        lines = unified_diff.splitlines() or ['']
+        last_idx = len(lines) - 1
+        for idx, line in enumerate(lines):
+            fragments = [head, '<span class="unified_nor">'] if idx == 0 else []
+
+            line_class = diff_mapping.get(line[:1])
+            if line_class is not None:
+                fragments.append('<span class="' + line_class + '">')
+            if wdiff_class is not None:
+                fragments.append('<span class="' + wdiff_class + '">')
+
+            pos = 0
+            for match in WDIFF_MARKER_RE.finditer(line):
+                marker = match.group(0)
+                if wdiff_closing is None and marker in wdiff_mapping:
+                    wdiff_class, wdiff_closing = wdiff_mapping[marker]
+                    fragments.extend((line[pos:match.start()], '<span class="' + wdiff_class + '">', marker))
+                    pos = match.end()
+                elif marker == wdiff_closing:
+                    fragments.extend((line[pos:match.end()], '</span>'))
+                    pos = match.end()
+                    wdiff_class, wdiff_closing = None, None
+            fragments.append(line[pos:])
+
+            if wdiff_class is not None:
+                fragments.append('</span>')
+            if line_class is not None:
+                fragments.append('</span>')
+            if idx == last_idx:
+                fragments.extend(('</span>', tail))
+
+            yield ''.join(fragments)
+
+    @staticmethod
+    def _table_text(s):
+        return html.escape(s).replace(' ', '&nbsp;')
+
+    def _table_cell(self, lineno, line, css_class=None, marked=None):
+        if lineno is None:
+            return '<td class="diff_header"></td><td nowrap="nowrap"></td>'
+
+        if marked is not None:
+            # Only highlight the part of the line between the common prefix and suffix
+            start, end = marked
+            text = ''.join((self._table_text(line[:start]),
+                            '<span class="diff_chg">', self._table_text(line[start:end]), '</span>',
+                            self._table_text(line[end:])))
+        elif css_class is not None:
+            text = '<span class="{}">{}</span>'.format(css_class, self._table_text(line))
+        else:
+            text = self._table_text(line)
+
+        return '<td class="diff_header">{}</td><td nowrap="nowrap">{}</td>'.format(lineno, text)
 
-        result = re.sub(r'^([-+]).*$', lambda x: '<span class="' + diff_mapping[x.group(1)] + '">' + x.group(0) + '</span>', result, flags=re.MULTILINE)
-        result = re.sub(WDIFF_ADDED_RE, lambda x: '<span class="diff_add">' + x.group(0) + '</span>', result, flags=re.MULTILINE + re.DOTALL)
-        result = re.sub(WDIFF_REMOVED_RE, lambda x: '<span class="diff_sub">' + x.group(0) + '</span>', result, flags=re.MULTILINE + re.DOTALL)
+    def _table_row(self, old_cell, new_cell):
+        return SafeHtml(''.join(('<tr><td class="diff_next"></td>', old_cell,
+                                 '<td class="diff_next"></td>', new_cell, '</tr>')))
 
-        return str(SafeHtml('<span class="unified_nor">' + result + '</span>')).splitlines()
+    @staticmethod
+    def _changed_range(old_line, new_line):
+        prefix = 0
+        max_prefix = min(len(old_line), len(new_line))
+        while prefix < max_prefix and old_line[prefix] == new_line[prefix]:
+            prefix += 1
+
+        suffix = 0
+        max_suffix = max_prefix - prefix
+        while suffix < max_suffix and old_line[-1 - suffix] == new_line[-1 - suffix]:
+            suffix += 1
+
+        return (prefix, len(old_line) - suffix), (prefix, len(new_line) - suffix)
+
+    def _diff_to_table(self, old_data, new_data, timestamp_old, timestamp_new, context_lines=3):
+        """Render a side-by-side diff table, row by row, from the unified diff hunks of the two versions"""
+        old_lines = old_data.splitlines()
+        new_lines = new_data.splitlines()
+
+        yield SafeHtml('<table class="diff" cellspacing="0" cellpadding="0" rules="groups">')
+        yield SafeHtml('<colgroup></colgroup>' * 6)
+        yield SafeHtml('<thead><tr><th class="diff_next"><br /></th><th colspan="2" class="diff_header">{}</th>'
+                       '<th class="diff_next"><br /></th><th colspan="2" class="diff_header">{}</th>'
+                       '</tr></thead>').format(timestamp_old, timestamp_new)
+
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+        empty = True
+        for group in matcher.get_grouped_opcodes(context_lines):
+            empty = False
+            yield SafeHtml('<tbody>')
+            for tag, i1, i2, j1, j2 in group:
+                for offset in range(max(i2 - i1, j2 - j1)):
+                    i, j = i1 + offset, j1 + offset
+                    old_line = old_lines[i] if i < i2 else None
+                    new_line = new_lines[j] if j < j2 else None
+
+                    if tag == 'equal':
+                        old_cell = self._table_cell(i + 1, old_line)
+                        new_cell = self._table_cell(j + 1, new_line)
+                    elif old_line is not None and new_line is not None:
+                        old_marked, new_marked = self._changed_range(old_line, new_line)
+                        old_cell = self._table_cell(i + 1, old_line, marked=old_marked)
+                        new_cell = self._table_cell(j + 1, new_line, marked=new_marked)
+                    else:
+                        old_cell = self._table_cell(i + 1 if old_line is not None else None, old_line, 'diff_sub')
+                        new_cell = self._table_cell(j + 1 if new_line is not None else None, new_line, 'diff_add')
+
+                    yield self._table_row(old_cell, new_cell)
+            yield SafeHtml('</tbody>')
+
+        if empty:
+            yield SafeHtml('<tbody>')
+            yield self._table_row('<td class="diff_header"></td><td nowrap="nowrap">No Differences Found</td>',
+                                  self._table_cell(None, None))
+            yield SafeHtml('</tbody>')
+
+        yield SafeHtml('</table>')
 
     def _format_content(self, job_state, difftype):
         if job_state.verb == 'error':
-            return SafeHtml('<pre style="text-color: red;">{error}</pre>').format(error=job_state.traceback.strip())
+            yield SafeHtml('<pre style="text-color: red;">{error}</pre>').format(error=job_state.traceback.strip())
+            return
 
         if job_state.verb == 'unchanged':
-            return SafeHtml('<pre>{old_data}</pre>').format(old_data=job_state.old_data)
+            yield SafeHtml('<pre>{old_data}</pre>').format(old_data=job_state.old_data)
+            return
 
-        if job_state.old_data in (None, job_state.new_data):
-            return SafeHtml('...')
+        if not job_state.released and job_state.old_data in (None, job_state.new_data):
+            yield SafeHtml('...')
+            return
 
         if difftype == 'table':
             timestamp_old = email.utils.formatdate(job_state.timestamp, localtime=True)
             timestamp_new = email.utils.formatdate(time.time(), localtime=True)
-            html_diff = difflib.HtmlDiff()
-            return SafeHtml(html_diff.make_table(job_state.old_data.splitlines(keepends=True),
-                                                 job_state.new_data.splitlines(keepends=True),
-                                                 timestamp_old, timestamp_new, True, 3))
+            yield from self._diff_to_table(job_state.old_data, job_state.new_data, timestamp_old, timestamp_new)
         elif difftype == 'unified':
-            return ''.join((
-                '<pre>',
-                '\n'.join(self._diff_to_html(job_state.get_diff())),
-                '</pre>',
-            ))
+            yield from self._diff_to_html(job_state.get_diff(), '<pre>', '</pre>')
         else:
             raise ValueError('Diff style not supported: %r' % (difftype,))
 
@@ -331,7 +561,7 @@ class TextReporter(ReporterBase):
         if job_state.verb == 'unchanged':
             return job_state.old_data
 
-        if job_state.old_data in (None, job_state.new_data):
+        if not job_state.released and job_state.old_data in (None, job_state.new_data):
             return None
 
         return job_state.get_diff()
@@ -366,6 +596,10 @@ class StdoutReporter(TextReporter):
 
     __kind__ = 'stdout'
 
+    PARALLEL_SEPARATE = False
+    SPOOL = False
+    INCREMENTAL = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._has_color = sys.stdout.isatty() and self.config.get('color', False)
@@ -401,26 +635,27 @@ class StdoutReporter(TextReporter):
         separators = (line_length * '=', line_length * '-', '-- ') if line_length else ()
         body = '\n'.join(super().submit())
 
-        for line in body.splitlines():
-            # Basic colorization for wdiff-style differences
-            line = re.sub(WDIFF_ADDED_RE, lambda x: self._green(x.group(0)), line)
-            line = re.sub(WDIFF_REMOVED_RE, lambda x: self._red(x.group(0)), line)
-
-            # FIXME: This isn't ideal, but works for now...
-            if line in separators:
-                print(line)
-            elif line.startswith('+'):
-                print(self._green(line))
-            elif line.startswith('-'):
-                print(self._red(line))
-            elif any(line.startswith(prefix) for prefix in ('NEW:', 'CHANGED:', 'UNCHANGED:', 'ERROR:')):
-                first, second = line.split(' ', 1)
-                if line.startswith('ERROR:'):
-                    print(first, self._red(second))
+        with STDOUT_LOCK:
+            for line in body.splitlines():
+                # Basic colorization for wdiff-style differences
+                line = re.sub(WDIFF_ADDED_RE, lambda x: self._green(x.group(0)), line)
+                line = re.sub(WDIFF_REMOVED_RE, lambda x: self._red(x.group(0)), line)
+
+                # FIXME: This isn't ideal, but works for now...
+                if line in separators:
+                    print(line)
+                elif line.startswith('+'):
+                    print(self._green(line))
+                elif line.startswith('-'):
+                    print(self._red(line))
+                elif any(line.startswith(prefix) for prefix in ('NEW:', 'CHANGED:', 'UNCHANGED:', 'ERROR:')):
+                    first, second = line.split(' ', 1)
+                    if line.startswith('ERROR:'):
+                        print(first, self._red(second))
+                    else:
+                        print(first, self._blue(second))
                 else:
-                    print(first, self._blue(second))
-            else:
-                print(line)
+                    print(line)
 
 
 class EMailReporter(TextReporter):
@@ -428,6 +663,36 @@ class EMailReporter(TextReporter):
 
     __kind__ = 'email'
 
+    def __init__(self, *args, mailer=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mailer = mailer
+
+    @classmethod
+    def create_mailer(cls, config):
+        if config['method'] == "smtp":
+            smtp_user = config['smtp'].get('user', None) or config['from']
+            # Legacy support: The current smtp "auth" setting was previously called "keyring"
+            if 'keyring' in config['smtp']:
+                logger.info('The SMTP config key "keyring" is now called "auth". See https://urlwatch.readthedocs.io/en/latest/deprecated.html')
+            use_auth = config['smtp'].get('auth', config['smtp'].get('keyring', False))
+            return SMTPMailer(smtp_user, config['smtp']['host'], config['smtp']['port'],
+                              config['smtp']['starttls'], use_auth,
+                              config['smtp'].get('insecure_password'))
+        elif config['method'] == "sendmail":
+            return SendmailMailer(config['sendmail']['path'])
+        else:
+            raise ValueError('Invalid entry for method {method}'.format(method=config['method']))
+
+    @classmethod
+    def _submit_reporter(cls, name, report, cfg, job_states, duration):
+        # Send all e-mails of this report using the same mailer (and SMTP session)
+        with cls.create_mailer(cfg) as mailer:
+            if cls.get_base_config(report).get('separate', False):
+                for job_state in job_states:
+                    cls(report, cfg, [job_state], duration, mailer=mailer).submit()
+            else:
+                cls(report, cfg, job_states, duration, mailer=mailer).submit()
+
     def submit(self):
         filtered_job_states = list(self.report.get_filtered_job_states(self.job_states))
 
@@ -442,20 +707,14 @@ class EMailReporter(TextReporter):
         if not body_text:
             logger.debug('Not sending e-mail (no changes)')
             return
-        if self.config['method'] == "smtp":
-            smtp_user = self.config['smtp'].get('user', None) or self.config['from']
-            # Legacy support: The current smtp "auth" setting was previously called "keyring"
-            if 'keyring' in self.config['smtp']:
-                logger.info('The SMTP config key "keyring" is now called "auth". See https://urlwatch.readthedocs.io/en/latest/deprecated.html')
-            use_auth = self.config['smtp'].get('auth', self.config['smtp'].get('keyring', False))
-            mailer = SMTPMailer(smtp_user, self.config['smtp']['host'], self.config['smtp']['port'],
-                                self.config['smtp']['starttls'], use_auth,
-                                self.config['smtp'].get('insecure_password'))
-        elif self.config['method'] == "sendmail":
-            mailer = SendmailMailer(self.config['sendmail']['path'])
+
+        if self.mailer is None:
+            with self.create_mailer(self.config) as mailer:
+                self._send(mailer, subject, body_text)
         else:
-            logger.error('Invalid entry for method {method}'.format(method=self.config['method']))
+            self._send(self.mailer, subject, body_text)
 
+    def _send(self, mailer, subject, body_text):
         reply_to = self.config.get('reply_to', '')
         if self.config['html']:
             body_html = '\n'.join(self.convert(HtmlReporter).submit())
@@ -620,6 +879,9 @@ class TelegramReporter(TextReporter):
     """Send a message using Telegram"""
     MAX_LENGTH = 4096
 
+    # https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+    WEBHOOK = WebhookSender(rate=1)
+
     __kind__ = 'telegram'
 
     def submit(self):
@@ -665,7 +927,8 @@ class TelegramReporter(TextReporter):
                 "parse_mode": "MarkdownV2"
             })
 
-        result = requests.post("https://api.telegram.org/bot{0}/sendMessage".format(bot_token), json=data)
+        result = self.WEBHOOK.post("https://api.telegram.org/bot{0}/sendMessage".format(bot_token),
+                                   key=(bot_token, chat_id), json=data)
         try:
             json_res = result.json()
 
@@ -685,6 +948,9 @@ class SlackReporter(TextReporter):
 
     __kind__ = 'slack'
 
+    # https://api.slack.com/docs/rate-limits#incoming-webhooks
+    WEBHOOK = WebhookSender(rate=1)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.max_length = self.config.get('max_message_length', 40000)
@@ -708,7 +974,7 @@ class SlackReporter(TextReporter):
     def submit_chunk(self, webhook_url, text):
         logger.debug("Sending {} request with text: {}".format(self.__kind__, text))
         post_data = {"text": text}
-        result = requests.post(webhook_url, json=post_data)
+        result = self.WEBHOOK.post(webhook_url, json=post_data)
         try:
             if result.status_code == requests.codes.ok:
                 logger.info("{} response: ok".format(self.__kind__))
@@ -727,12 +993,18 @@ class MattermostReporter(SlackReporter):
 
     __kind__ = 'mattermost'
 
+    # Default rate limit of the Mattermost server (RateLimitSettings, if enabled)
+    WEBHOOK = WebhookSender(rate=10, capacity=10)
+
 
 class DiscordReporter(TextReporter):
     """Send a message to a Discord channel"""
 
     __kind__ = 'discord'
 
+    # Webhooks are limited to 5 requests per 2 seconds (reported in X-RateLimit-* headers)
+    WEBHOOK = WebhookSender(rate=2.5, capacity=5)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.max_length = self.config.get('max_message_length', 2000)
@@ -779,7 +1051,7 @@ class DiscordReporter(TextReporter):
 
         logger.debug("Sending Discord request with post_data: {0}".format(post_data))
 
-        result = requests.post(webhook_url, json=post_data)
+        result = self.WEBHOOK.post(webhook_url, json=post_data)
         try:
             if result.status_code in (requests.codes.ok, requests.codes.no_content):
                 logger.info("Discord response: ok")
@@ -958,7 +1230,7 @@ class MarkdownReporter(ReporterBase):
         if job_state.verb == 'unchanged':
             return job_state.old_data
 
-        if job_state.old_data in (None, job_state.new_data):
+        if not job_state.released and job_state.old_data in (None, job_state.new_data):
             return None
 
         return job_state.get_diff()
@@ -1043,8 +1315,7 @@ class XMPPReporter(TextReporter):
 
         xmpp = XMPP(sender, recipient, self.config.get('insecure_password'))
 
-        for chunk in chunkstring(text, self.MAX_LENGTH, numbering=True):
-            asyncio.run(xmpp.send(chunk))
+        asyncio.run(xmpp.send_all(chunkstring(text, self.MAX_LENGTH, numbering=True)))
 
 
 class ProwlReporter(TextReporter):
@@ -1112,6 +1383,8 @@ class ShellReporter(TextReporter):
 
     __kind__ = 'shell'
 
+    INCREMENTAL = True
+
     def submit(self):
         text = '\n'.join(super().submit())
 
@@ -1204,3 +1477,119 @@ class NtfyReporter(TextReporter):
                 r.raise_for_status()
             except Exception:  # catch any error so other job states aren't affected if publishing fails
                 logger.exception(f"Failed to publish to ntfy topic '{topic_url}'")
+
+
+class NdjsonReporter(ReporterBase):
+    """Write one JSON record per job to a file or stdout"""
+
+    __kind__ = 'ndjson'
+
+    PARALLEL_SEPARATE = False
+    SPOOL = False
+    INCREMENTAL = True
+
+    def _record(self, job_state):
+        return {
+            'verb': job_state.verb,
+            'guid': job_state.job.get_guid(),
+            'name': job_state.job.pretty_name(),
+            'location': job_state.job.get_location(),
+            'timestamp': job_state.timestamp,
+            'current_timestamp': job_state.current_timestamp or time.time(),
+            'diff': job_state.get_diff() if job_state.verb == 'changed' else None,
+            'error': job_state.traceback.strip() if job_state.verb == 'error' else None,
+        }
+
+    def submit(self):
+        records = (json.dumps(self._record(job_state), ensure_ascii=False) + '\n'
+                   for job_state in self.report.get_filtered_job_states(self.job_states))
+
+        # Write (and flush) each record on its own, so that consumers can process it right away
+        path = self.config.get('path')
+        if not path:
+            for record in records:
+                with STDOUT_LOCK:
+                    sys.stdout.write(record)
+                    sys.stdout.flush()
+            return
+
+        with open(os.path.expanduser(path), 'a', encoding='utf-8') as fp:
+            for record in records:
+                fp.write(record)
+                fp.flush()
+
+
+class PrometheusReporter(ReporterBase):
+    """Write metrics of the run to a Prometheus textfile"""
+
+    __kind__ = 'prometheus'
+
+    PARALLEL_SEPARATE = False
+    SPOOL = False
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _metric(self, name, help, samples):
+        yield '# HELP {} {}'.format(name, help)
+        yield '# TYPE {} gauge'.format(name)
+        for labels, value in samples:
+            if labels:
+                labels = '{{{}}}'.format(','.join('{}="{}"'.format(key, self._escape(label))
+                                                  for key, label in labels.items()))
+            yield '{}{} {}'.format(name, labels or '', value)
+
+    def _job_metric(self, name, help, get_value):
+        samples = []
+        # Also include the jobs that are not reported (e.g. errors that are retried), so that tries can be monitored
+        for job_state in self.report.finished_job_states or self.job_states:
+            value = get_value(job_state)
+            if value is not None:
+                samples.append(({'guid': job_state.job.get_guid(), 'name': job_state.job.pretty_name(),
+                                 'location': job_state.job.get_location()}, value))
+        return self._metric(name, help, samples)
+
+    @staticmethod
+    def _stage_time(job_state, prefix):
+        times = [stat['wall'] for stage, stat in job_state.stats.items() if stage.split(':', 1)[0] == prefix]
+        return sum(times) if times else None
+
+    def _format_metrics(self):
+        counts = collections.Counter(job_state.verb for job_state in self.job_states)
+
+        yield from self._metric('urlwatch_last_run_timestamp_seconds', 'Time when the last run finished',
+                                [({}, time.time())])
+        yield from self._metric('urlwatch_run_duration_seconds', 'Duration of the last run',
+                                [({}, self.duration.total_seconds())])
+        yield from self._metric('urlwatch_jobs', 'Number of jobs in the last run, by result',
+                                [({'verb': verb}, counts[verb]) for verb in ('new', 'changed', 'unchanged', 'error')])
+
+        yield from self._job_metric('urlwatch_job_retrieve_seconds', 'Time spent retrieving the job',
+                                    lambda job_state: self._stage_time(job_state, 'retrieve'))
+        yield from self._job_metric('urlwatch_job_response_seconds', 'Time until the response headers arrived',
+                                    lambda job_state: self._stage_time(job_state, 'response'))
+        yield from self._job_metric('urlwatch_job_filter_seconds', 'Time spent in the filters of the job',
+                                    lambda job_state: self._stage_time(job_state, 'filter'))
+        yield from self._job_metric('urlwatch_job_received_bytes', 'Size of the retrieved content',
+                                    lambda job_state: job_state.bytes_received)
+        yield from self._job_metric('urlwatch_job_http_status', 'HTTP status code of the response',
+                                    lambda job_state: job_state.http_status)
+        yield from self._job_metric('urlwatch_job_tries', 'Number of consecutive failed tries',
+                                    lambda job_state: job_state.tries)
+
+        cache_size = self.report.cache_storage.get_size() if self.report.cache_storage is not None else None
+        if cache_size is not None:
+            yield from self._metric('urlwatch_cache_size_bytes', 'Size of the cache database', [({}, cache_size)])
+
+    def submit(self):
+        path = self.config.get('path')
+        if not path:
+            raise ValueError('No path configured for the prometheus reporter')
+
+        # The file can be read at any time, so it has to be replaced atomically
+        path = os.path.expanduser(path)
+        with open(path + '.tmp', 'w') as fp:
+            for line in self._format_metrics():
+                fp.write(line + '\n')
+        atomic_rename(path + '.tmp', path)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of urlwatch (https://thp.io/2008/urlwatch/).
+# Copyright (c) 2008-2024 Thomas Perl <m@thp.io>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import datetime
+import json
+import logging
+import os
+import time
+
+import minidb
+
+from .handler import JobState
+from .reporters import ReporterBase
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolEntry(minidb.Model):
+    reporter = str
+    created = int
+    tries = int
+    payload = str
+
+
+class NotificationSpool(object):
+    """Outbox of reports that still have to be delivered by a reporter
+
+    Reports are queued for each enabled reporter at the end of a run, and
+    removed once the reporter delivered them. Failed deliveries are retried
+    on the next flush, until max_tries is reached. The flush at the end of
+    a run waits at most flush_timeout seconds for the reporters.
+    """
+
+    def __init__(self, filename, max_tries=10, flush=True, flush_timeout=None):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self.filename = filename
+        self.max_tries = max_tries
+        self.flush_on_submit = flush
+        self.flush_timeout = flush_timeout
+
+        self.db = minidb.Store(self.filename, vacuum_on_close=False)
+        self.db.register(SpoolEntry)
+
+    def close(self):
+        self.db.close()
+        self.db = None
+
+    def pending(self):
+        return sorted(SpoolEntry.load(self.db), key=lambda entry: entry.id)
+
+    def enqueue(self, reporter, payload):
+        self.db.save(SpoolEntry(reporter=reporter, created=int(time.time()), tries=0, payload=payload))
+        self.db.commit()
+
+    def submit(self, report, job_states, duration, names=None):
+        """Queue a report for all spooled reporters, and submit it directly to the others"""
+        direct = []
+        spooled = []
+        for name in (ReporterBase.enabled_reporters(report) if names is None else names):
+            if ReporterBase.__subclasses__[name].SPOOL:
+                spooled.append(name)
+            else:
+                direct.append((name, job_states, duration))
+
+        shown = {id(job_state) for job_state in report.get_filtered_job_states(job_states)}
+        if spooled and shown:
+            # Job states that are not shown are only needed for the job count in the footer
+            payload = json.dumps({
+                'duration': duration.total_seconds(),
+                'job_states': [job_state.serialize(include_data=id(job_state) in shown)
+                               for job_state in job_states],
+            })
+            for name in spooled:
+                logger.info('Queueing report for %s in %s', name, self.filename)
+                self.enqueue(name, payload)
+
+        if self.flush_on_submit:
+            # Reports that are not delivered in time stay queued for the next flush
+            self.flush(report, direct, timeout=self.flush_timeout)
+        elif direct:
+            ReporterBase.submit_parallel(report, direct)
+
+    def flush(self, report, submissions=(), timeout=None):
+        """Deliver all queued reports (and the given submissions), returns the number of reports still queued"""
+        submissions = list(submissions)
+        offset = len(submissions)
+
+        entries = []
+        payloads = []
+        enabled = ReporterBase.enabled_reporters(report)
+        for entry in self.pending():
+            if entry.reporter not in enabled:
+                logger.warning('Dropping queued report for %s (reporter not enabled)', entry.reporter)
+                entry.delete()
+                continue
+
+            payload = json.loads(entry.payload)
+            job_states = [JobState.unserialize(data) for data in payload['job_states']]
+            submissions.append((entry.reporter, job_states, datetime.timedelta(seconds=payload['duration'])))
+            entries.append(entry)
+            payloads.append(payload)
+        self.db.commit()
+
+        if not submissions:
+            return 0
+
+        failed = {}
+        results = ReporterBase.submit_parallel(report, submissions, timeout, failed)
+
+        remaining = 0
+        for idx, (entry, payload, delivered) in enumerate(zip(entries, payloads, results[offset:]), offset):
+            if delivered:
+                entry.delete()
+                continue
+
+            if idx in failed:
+                # Only keep the separate reports that were not delivered
+                failed_ids = {id(job_state) for job_state in failed[idx]}
+                payload['job_states'] = [data for job_state, data in zip(submissions[idx][1], payload['job_states'])
+                                         if id(job_state) in failed_ids]
+                entry.payload = json.dumps(payload)
+
+            entry.tries += 1
+            if entry.tries >= self.max_tries:
+                logger.error('Giving up on report for %s queued at %s after %d tries', entry.reporter,
+                             datetime.datetime.fromtimestamp(entry.created), entry.tries)
+                entry.delete()
+            else:
+                logger.warning('Report for %s not delivered (try %d of %d), keeping it queued',
+                               entry.reporter, entry.tries, self.max_tries)
+                entry.save()
+                remaining += 1
+        self.db.commit()
+
+        return remaining
@@ -30,6 +30,7 @@
 
 import os
 import stat
+import json
 import copy
 import platform
 import collections
@@ -76,6 +77,7 @@ DEFAULT_CONFIG = {
             'footer': True,
             'minimal': False,
             'separate': False,
+            'stats': False,
         },
 
         'markdown': {
@@ -83,16 +85,19 @@ DEFAULT_CONFIG = {
             'footer': True,
             'minimal': False,
             'separate': False,
+            'stats': False,
         },
 
         'html': {
             'diff': 'unified',  # "unified" or "table"
             'separate': False,
+            'stats': False,
         },
 
         'stdout': {
             'enabled': True,
             'color': True,
+            'incremental': False,
         },
 
         'email': {
@@ -205,7 +210,35 @@ DEFAULT_CONFIG = {
             'command': '',
             'ignore_stdout': True,
             'ignore_stderr': False,
+            'incremental': False,
         },
+        'ndjson': {
+            'enabled': False,
+            'path': '',
+            'separate': False,
+            'incremental': False,
+        },
+        'prometheus': {
+            'enabled': False,
+            'path': '',
+        },
+    },
+
+    'spool': {
+        'enabled': False,
+        'path': None,
+        'flush': True,
+        'flush_timeout': 60,
+        'max_tries': 10,
+    },
+
+    'daemon': {
+        'interval': 3600,
+    },
+
+    'job_order': {
+        'longest_first': True,
+        'tags': {},
     },
 
     'job_defaults': {
@@ -452,6 +485,11 @@ class UrlsTxt(BaseTxtFileStorage, UrlsBaseFileStorage):
 
 
 class CacheStorage(BaseFileStorage, metaclass=ABCMeta):
+    def __init__(self, filename):
+        super().__init__(filename)
+        # Time spent saving the latest snapshot of each job in this process (see JobState.save)
+        self.save_stats = {}
+
     @abstractmethod
     def close(self):
         ...
@@ -465,9 +503,57 @@ class CacheStorage(BaseFileStorage, metaclass=ABCMeta):
         ...
 
     @abstractmethod
-    def save(self, job, guid, data, timestamp, tries, etag=None):
+    def save(self, job, guid, data, timestamp, tries, etag=None, stats=None):
         ...
 
+    def update_stats(self, guid, stats, checked=None):
+        # Timing statistics are optional, storages that do not support them ignore them
+        pass
+
+    def update_stats_many(self, updates):
+        # Statistics of all jobs of a run that did not save a new snapshot, as (guid, stats, checked)
+        for guid, stats, checked in updates:
+            self.update_stats(guid, stats, checked)
+
+    def get_stats(self, guid):
+        return None
+
+    def get_all_stats(self):
+        # Timing statistics of the latest run of all jobs
+        result = {}
+        for guid in self.get_guids():
+            stats = self.get_stats(guid)
+            if stats:
+                result[guid] = stats
+        return result
+
+    def get_checked_timestamps(self):
+        # Time of the last run of each job; storages that do not record runs without
+        # a new snapshot (see update_stats) return the time of the latest snapshot
+        result = {}
+        for guid in self.get_guids():
+            _, timestamp, _, _ = self.load(None, guid)
+            if timestamp is not None:
+                result[guid] = timestamp
+        return result
+
+    def get_change_timestamps(self, count=10):
+        # Timestamps (oldest first) of the latest count distinct snapshots of each job
+        result = {}
+        for guid in self.get_guids():
+            if hasattr(self, 'get_history_data'):
+                timestamps = sorted(self.get_history_data(guid, count).values())
+            else:
+                _, timestamp, _, _ = self.load(None, guid)
+                timestamps = [timestamp] if timestamp is not None else []
+            if timestamps:
+                result[guid] = timestamps
+        return result
+
+    def get_size(self):
+        # Size of the cache in bytes (if known)
+        return None
+
     @abstractmethod
     def delete(self, guid):
         ...
@@ -518,6 +604,9 @@ class CacheDirStorage(CacheStorage):
     def get_guids(self):
         return os.listdir(self.filename)
 
+    def get_size(self):
+        return sum(os.path.getsize(self._get_filename(guid)) for guid in self.get_guids())
+
     def load(self, job, guid):
         filename = self._get_filename(guid)
         if not os.path.exists(filename):
@@ -534,8 +623,8 @@ class CacheDirStorage(CacheStorage):
 
         return data, timestamp, None, None
 
-    def save(self, job, guid, data, timestamp, tries, etag=None):
-        # Timestamp, tries and ETag are always ignored
+    def save(self, job, guid, data, timestamp, tries, etag=None, stats=None):
+        # Timestamp, tries, ETag and stats are always ignored
         filename = self._get_filename(guid)
         with open(filename, 'w+') as fp:
             fp.write(data)
@@ -562,6 +651,8 @@ class CacheEntry(minidb.Model):
     data = str
     tries = int
     etag = str
+    stats = str
+    checked = int
 
 
 class CacheMiniDBStorage(CacheStorage):
@@ -584,6 +675,9 @@ class CacheMiniDBStorage(CacheStorage):
     def get_guids(self):
         return (guid for guid, in CacheEntry.query(self.db, minidb.Function('distinct', CacheEntry.c.guid)))
 
+    def get_size(self):
+        return os.path.getsize(self.filename)
+
     def load(self, job, guid):
         for data, timestamp, tries, etag in CacheEntry.query(self.db,
                                                              CacheEntry.c.data // CacheEntry.c.timestamp
@@ -619,10 +713,66 @@ class CacheMiniDBStorage(CacheStorage):
                                                                 ))
         return guid in self._cached_has_history_data_set
 
-    def save(self, job, guid, data, timestamp, tries, etag=None):
-        self.db.save(CacheEntry(guid=guid, timestamp=timestamp, data=data, tries=tries, etag=etag))
+    def save(self, job, guid, data, timestamp, tries, etag=None, stats=None):
+        self.db.save(CacheEntry(guid=guid, timestamp=timestamp, data=data, tries=tries, etag=etag,
+                                stats=json.dumps(stats) if stats else None))
+        self.db.commit()
+
+    def _latest_entry_id(self, guid):
+        for entry_id, in CacheEntry.query(self.db, CacheEntry.c.id,
+                                          order_by=minidb.columns(CacheEntry.c.timestamp.desc,
+                                                                  CacheEntry.c.tries.desc),
+                                          where=CacheEntry.c.guid == guid, limit=1):
+            return entry_id
+
+        return None
+
+    def update_stats(self, guid, stats, checked=None):
+        self.update_stats_many([(guid, stats, checked)])
+
+    def update_stats_many(self, updates):
+        for guid, stats, checked in updates:
+            entry_id = self._latest_entry_id(guid)
+            if entry_id is not None:
+                entry = CacheEntry.get(self.db, id=entry_id)
+                entry.stats = json.dumps(stats)
+                if checked is not None:
+                    entry.checked = int(checked)
+                entry.save()
+        # A single commit for all jobs of the run
         self.db.commit()
 
+    def get_all_stats(self):
+        # With max(), SQLite takes the other (bare) columns from the row with the maximum,
+        # so that only the latest statistics of each guid are returned
+        return {guid: json.loads(stats) for guid, stats, _ in CacheEntry.query(
+            self.db, CacheEntry.c.guid // CacheEntry.c.stats // minidb.Function('max', CacheEntry.c.timestamp),
+            where=CacheEntry.c.stats != None, group_by=CacheEntry.c.guid)}  # noqa:E711
+
+    def get_change_timestamps(self, count=10):
+        successful = (CacheEntry.c.tries == 0) | (CacheEntry.c.tries == None)  # noqa:E711
+        result = {}
+        # First appearance of each distinct snapshot (saves of unchanged data, e.g. after an error, are no changes)
+        for guid, timestamp in CacheEntry.query(self.db, CacheEntry.c.guid // minidb.Function(
+                'min', CacheEntry.c.timestamp), where=successful,
+                group_by=minidb.columns(CacheEntry.c.guid, CacheEntry.c.data)):
+            result.setdefault(guid, []).append(timestamp)
+        return {guid: sorted(timestamps)[-count:] for guid, timestamps in result.items()}
+
+    def get_checked_timestamps(self):
+        return dict(CacheEntry.query(self.db, CacheEntry.c.guid // minidb.Function(
+            'max', minidb.Function('coalesce', CacheEntry.c.checked, CacheEntry.c.timestamp)),
+            group_by=CacheEntry.c.guid))
+
+    def get_stats(self, guid):
+        entry_id = self._latest_entry_id(guid)
+        if entry_id is not None:
+            stats, = next(CacheEntry.query(self.db, CacheEntry.c.stats, where=CacheEntry.c.id == entry_id))
+            if stats:
+                return json.loads(stats)
+
+        return None
+
     def delete(self, guid):
         CacheEntry.delete_where(self.db, CacheEntry.c.guid == guid)
         self.db.commit()
@@ -710,15 +860,46 @@ class CacheRedisStorage(CacheStorage):
     def has_history_data(self, guid):
         return bool(self.get_history_data(guid))
 
-    def save(self, job, guid, data, timestamp, tries, etag=None):
+    def save(self, job, guid, data, timestamp, tries, etag=None, stats=None):
         r = {
             'data': data,
             'timestamp': timestamp,
             'tries': tries,
             'etag': etag,
+            'stats': stats,
         }
         self.db.lpush(self._make_key(guid), msgpack.packb(r, use_bin_type=True))
 
+    def update_stats(self, guid, stats, checked=None):
+        key = self._make_key(guid)
+        data = self.db.lindex(key, 0)
+        if data:
+            r = msgpack.unpackb(data)
+            r['stats'] = stats
+            if checked is not None:
+                r['checked'] = checked
+            self.db.lset(key, 0, msgpack.packb(r, use_bin_type=True))
+
+    def get_checked_timestamps(self):
+        guids = self.get_guids()
+        pipeline = self.db.pipeline()
+        for guid in guids:
+            pipeline.lindex(self._make_key(guid), 0)
+
+        result = {}
+        for guid, data in zip(guids, pipeline.execute()):
+            if data:
+                r = msgpack.unpackb(data)
+                result[guid] = r.get('checked') or r['timestamp']
+        return result
+
+    def get_stats(self, guid):
+        data = self.db.lindex(self._make_key(guid), 0)
+        if data:
+            return msgpack.unpackb(data).get('stats')
+
+        return None
+
     def delete(self, guid):
         self.db.delete(self._make_key(guid))
 
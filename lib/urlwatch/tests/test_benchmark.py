@@ -0,0 +1,66 @@
+import pytest
+
+from urlwatch import benchmark
+from urlwatch.storage import CacheMiniDBStorage
+
+
+def test_fixture_pages_change_deterministically():
+    changed = [page_id for page_id in range(100) if benchmark.page_changed(page_id, 1, 10)]
+    assert 0 < len(changed) < 30
+    assert benchmark.generate_page(changed[0], 0, 1000, 10) != benchmark.generate_page(changed[0], 1, 1000, 10)
+    unchanged = next(page_id for page_id in range(100) if page_id not in changed)
+    assert benchmark.generate_page(unchanged, 0, 1000, 10) == benchmark.generate_page(unchanged, 1, 1000, 10)
+
+
+def test_benchmark_jobs():
+    result = benchmark.benchmark_jobs(jobs=20, workers=4, cache='minidb', runs=2, size=1000, change_percent=50)
+
+    first, second = result['runs']
+    assert first['verbs']['new'] == 20
+    assert second['verbs']['changed'] == sum(benchmark.page_changed(idx, 1, 50) for idx in range(20))
+    assert second['verbs']['changed'] + second['verbs']['unchanged'] == 20
+    assert second['cache_size'] >= first['cache_size'] > 0
+    assert first['latency']['p50'] is not None
+
+
+def test_benchmark_filters():
+    result = benchmark.benchmark_filters(['strip', 'grep', 'format-json', 'ocr'], sizes=[1000], min_time=0.01)
+
+    entries = {entry['filter']: entry for entry in result['results']}
+    assert entries['grep']['ops_per_second'] > 0
+    assert entries['format-json']['corpus'] == 'json'
+    assert entries['format-json']['peak_alloc'] > 0
+    assert 'error' in entries['ocr']
+
+    lines = list(benchmark.format_filters_result(result, result))
+    assert len(lines) == 4
+    assert '+0.0%' in lines[1]
+
+
+def test_benchmark_cache():
+    result = benchmark.benchmark_cache('minidb', guids=10, versions=3, size=500)
+
+    operations = result['operations']
+    assert operations['save']['count'] == 30
+    assert operations['load']['count'] == operations['get_history_data']['count'] == 10
+    assert operations['gc']['count'] == 1
+    assert result['cache_size'] > 0
+    assert len(list(benchmark.format_cache_result(result))) == 1 + len(operations)
+
+
+def test_benchmark_refuses_non_empty_cache(monkeypatch, tmp_path):
+    filename = str(tmp_path / 'cache.db')
+    cache_storage = CacheMiniDBStorage(filename)
+    cache_storage.save(None, 'existing', 'data', 0, 0)
+    cache_storage.close()
+    # Stands in for a redis database that is already in use
+    monkeypatch.setattr(benchmark, 'CacheRedisStorage', lambda uri: CacheMiniDBStorage(filename))
+
+    with pytest.raises(ValueError):
+        benchmark.benchmark_cache('redis://localhost:6379/0', guids=10, versions=3, size=500)
+
+    cache_storage = CacheMiniDBStorage(filename)
+    try:
+        assert list(cache_storage.get_guids()) == ['existing']
+    finally:
+        cache_storage.close()
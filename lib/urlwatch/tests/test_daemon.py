@@ -0,0 +1,105 @@
+import copy
+import os
+import types
+
+import pytest
+
+from urlwatch import daemon
+from urlwatch.jobs import ShellJob, UrlJob, adapt_interval, parse_interval
+from urlwatch.main import Urlwatch
+from urlwatch.storage import DEFAULT_CONFIG, UrlsYaml
+
+
+def test_parse_interval():
+    assert parse_interval(90) == 90
+    assert parse_interval('90') == 90
+    assert parse_interval('30m') == 30 * 60
+    assert parse_interval('1.5h') == 90 * 60
+    assert parse_interval('1d') == 24 * 60 * 60
+    for value in ('0', '-5m', 'often', '5y', True):
+        with pytest.raises(ValueError):
+            parse_interval(value)
+
+
+def test_daemon_runs_jobs_when_due(monkeypatch):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    batches = []
+    urlwatcher = types.SimpleNamespace(
+        urlwatch_config=types.SimpleNamespace(tags=False, idx_set=frozenset(), joblist=[], urls='/nonexistent'),
+        config_storage=types.SimpleNamespace(config=config),
+        cache_storage=types.SimpleNamespace(get_checked_timestamps=lambda: {}),
+        jobs=[UrlJob(url='http://example.com/', interval='10m'),
+              ShellJob(command='true'),
+              UrlJob(url='http://example.org/', interval='invalid')],
+        should_run=lambda idx, job: True,
+        run_jobs=lambda jobs: batches.append([job.get_location() for job in jobs]),
+    )
+    urlwatcher.get_job_interval = lambda job, default=None, now=None: Urlwatch.get_job_interval(urlwatcher, job, default, now)
+
+    now = 1000
+    monkeypatch.setattr(daemon.time, 'time', lambda: now)
+
+    scheduler = daemon.Daemon(urlwatcher)
+    scheduler.sync_jobs(now)
+    assert len(scheduler.pop_due_jobs(now)) == 3
+    assert scheduler.pop_due_jobs(now) == []
+
+    scheduler.run_batch(list(scheduler.jobs.values()))
+    assert sorted(scheduler.due.values()) == [now + 10 * 60, now + 3600, now + 3600]
+    assert scheduler.next_wakeup(now) == daemon.RELOAD_CHECK_INTERVAL
+
+    now += 10 * 60
+    scheduler.run_batch(scheduler.pop_due_jobs(now))
+    assert batches[-1] == ['http://example.com/']
+    assert scheduler.next_wakeup(now + 10 * 60 - 5) == 5
+
+    # Removed jobs are not run anymore
+    urlwatcher.jobs = urlwatcher.jobs[1:]
+    scheduler.sync_jobs(now)
+    now += 3600
+    assert sorted(job.get_location() for job in scheduler.pop_due_jobs(now)) == ['http://example.org/', 'true']
+
+
+def test_adapt_interval():
+    hour, day = 60 * 60, 24 * 60 * 60
+    monthly = [0, 30 * day, 60 * day]
+
+    # No history: minimum interval
+    assert adapt_interval(hour, day, [], 0) == hour
+    # Right after a change: back to the minimum interval
+    assert adapt_interval(hour, day, monthly, 60 * day + 60) == hour
+    # Stable pages are checked less often, up to the maximum interval
+    assert adapt_interval(hour, day, monthly, 60 * day + 10 * hour) == 5 * hour
+    assert adapt_interval(hour, day, monthly, 70 * day) == day
+    # Pages that change often stay at short intervals
+    assert adapt_interval(hour, day, [0, 2 * hour, 4 * hour], 100 * day) == hour
+
+
+def test_daemon_keeps_jobs_if_reload_fails(tmp_path):
+    urls = tmp_path / 'urls.yaml'
+    urls.write_text('url: http://example.com/\n')
+    os.utime(urls, (1000, 1000))
+
+    urlwatcher = types.SimpleNamespace(
+        urlwatch_config=types.SimpleNamespace(tags=False, idx_set=frozenset(), joblist=[], urls=str(urls)),
+        config_storage=types.SimpleNamespace(config=copy.deepcopy(DEFAULT_CONFIG)),
+        cache_storage=types.SimpleNamespace(get_checked_timestamps=lambda: {}),
+        urls_storage=UrlsYaml(str(urls)),
+        should_run=lambda idx, job: True,
+    )
+    urlwatcher.load_jobs = lambda: Urlwatch.load_jobs(urlwatcher)
+    urlwatcher.get_job_interval = lambda job, default=None, now=None: Urlwatch.get_job_interval(urlwatcher, job, default, now)
+    urlwatcher.load_jobs()
+
+    scheduler = daemon.Daemon(urlwatcher)
+    scheduler.sync_jobs(1000)
+
+    urls.write_text('url: [http://example.org/\n')
+    os.utime(urls, (2000, 2000))
+    scheduler.reload_jobs_if_changed(2000)
+    assert [job.get_location() for job in scheduler.jobs.values()] == ['http://example.com/']
+
+    urls.write_text('url: http://example.org/\n')
+    os.utime(urls, (3000, 3000))
+    scheduler.reload_jobs_if_changed(3000)
+    assert [job.get_location() for job in scheduler.jobs.values()] == ['http://example.org/']
@@ -5,15 +5,21 @@ from urlwatch.jobs import UrlJob, JobBase, ShellJob
 from urlwatch.storage import UrlsYaml, UrlsTxt
 
 import contextlib
+import copy
+import types
 import pytest
 
+import subprocess
 import tempfile
+import time
 import os
 
-from urlwatch import storage
+import urlwatch
+from urlwatch import storage, worker
 from urlwatch.config import CommandConfig
 from urlwatch.storage import YamlConfigStorage, CacheMiniDBStorage
 from urlwatch.main import Urlwatch
+from urlwatch.handler import JobState, Report
 from urlwatch.util import import_module_from_source
 
 root = os.path.join(os.path.dirname(__file__), '..', '..', '..')
@@ -331,3 +337,266 @@ def test_reset_tries_to_zero_when_successful():
             assert tries == 0
         finally:
             cache_storage.close()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='diff(1) not available on Windows')
+def test_diff_tool_memfd_matches_tempfile():
+    job = JobBase.unserialize({'url': 'http://example.com/', 'diff_tool': 'diff -u'})
+    job_state = JobState(None, job)
+    job_state.old_data = 'a\nb\nc\n'
+    job_state.new_data = 'a\nB\nc\n'
+
+    tempfile_diff = job_state._run_diff_tool_tempfile()
+    assert '-b' in tempfile_diff.splitlines()
+    assert '+B' in tempfile_diff.splitlines()
+
+    if hasattr(os, 'memfd_create'):
+        memfd_diff = job_state._run_diff_tool_memfd()
+        assert memfd_diff.splitlines()[2:] == tempfile_diff.splitlines()[2:]
+
+
+def test_diff_is_generated_in_worker():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        page = os.path.join(tmpdir, 'page.txt')
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            job = UrlJob(url='file://' + page)
+
+            with open(page, 'w') as fp:
+                fp.write('old\n')
+            with JobState(cache_storage, job) as job_state:
+                job_state.process()
+                job_state.save()
+                assert not job_state.changed
+
+            with open(page, 'w') as fp:
+                fp.write('new\n')
+            with JobState(cache_storage, job) as job_state:
+                job_state.process()
+                assert job_state.changed
+                assert job_state._generated_diff is not None
+                assert '+new' in job_state._generated_diff.splitlines()
+        finally:
+            cache_storage.close()
+
+
+def test_stage_timing_is_stored_in_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        page = os.path.join(tmpdir, 'page.txt')
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            job = UrlJob(url='file://' + page, filter=[{'strip': {}}])
+
+            with open(page, 'w') as fp:
+                fp.write('old\n')
+            with JobState(cache_storage, job) as job_state:
+                job_state.process()
+                job_state.save()
+
+            stats = cache_storage.get_stats(job.get_guid())
+            assert list(stats) == ['load', 'retrieve', 'filter:auto', 'filter:strip']
+            assert all(stat['wall'] >= 0 and stat['cpu'] >= 0 for stat in stats.values())
+
+            # Unchanged jobs update the statistics of the latest snapshot (with the time it took to save it)
+            with JobState(cache_storage, job) as job_state:
+                job_state.process()
+                assert not job_state.changed
+                job_state.stats['retrieve']['wall'] = 42
+                cache_storage.update_stats_many([job_state.get_stats_update()])
+
+            stats = cache_storage.get_stats(job.get_guid())
+            assert stats['retrieve']['wall'] == 42
+            assert stats['save']['wall'] > 0
+            assert len(list(cache_storage.get_history_data(job.get_guid(), 10))) == 1
+        finally:
+            cache_storage.close()
+
+
+def test_jobs_are_skipped_until_interval_elapsed():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        urls = os.path.join(tmpdir, 'urls.yaml')
+        cache = os.path.join(tmpdir, 'cache.db')
+        config = os.path.join(here, 'data', 'urlwatch.yaml')
+        with open(urls, 'w') as fp:
+            fp.write('command: echo hourly\ninterval: 1h\n---\ncommand: echo always\n')
+
+        def run():
+            cache_storage = CacheMiniDBStorage(cache)
+            urlwatcher = Urlwatch(ConfigForTest(config, urls, cache, '', True), YamlConfigStorage(config),
+                                  cache_storage, UrlsYaml(urls))
+            urlwatcher.run_jobs()
+            return urlwatcher, cache_storage
+
+        urlwatcher, cache_storage = run()
+        cache_storage.close()
+        assert len(urlwatcher.report.job_states) == 2
+
+        urlwatcher, cache_storage = run()
+        try:
+            assert [job_state.job.command for job_state in urlwatcher.report.job_states] == ['echo always']
+            hourly = urlwatcher.jobs[0]
+            assert urlwatcher.is_due(hourly, now=time.time() + 3600)
+            assert not urlwatcher.is_due(hourly, now=time.time() + 3000)
+        finally:
+            cache_storage.close()
+
+
+def test_change_timestamps_of_distinct_snapshots():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            for timestamp, data, tries in ((10, 'a', 0), (20, 'b', 0), (30, 'c', 0)):
+                cache_storage.save(None, 'guid', data, timestamp, tries)
+            cache_storage.save(None, 'other', 'c', 15, 0)
+
+            assert cache_storage.get_change_timestamps() == {'guid': [10, 20, 30], 'other': [15]}
+            assert cache_storage.get_change_timestamps(count=2)['guid'] == [20, 30]
+
+            # An error (saved with the old data), the save after recovering and saves
+            # of identical data are no changes
+            for timestamp, data, tries in ((40, 'c', 1), (50, 'c', 2), (60, 'c', 0), (70, 'c', 0)):
+                cache_storage.save(None, 'guid', data, timestamp, tries)
+            assert cache_storage.get_change_timestamps()['guid'] == [10, 20, 30]
+        finally:
+            cache_storage.close()
+
+
+def test_all_stats_are_the_latest_of_each_job():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            for timestamp, guid, wall in ((10, 'a', 1.0), (30, 'a', 3.0), (20, 'a', 2.0), (15, 'b', 5.0)):
+                cache_storage.save(None, guid, 'data', timestamp, 0, stats={'retrieve': {'wall': wall, 'cpu': 0.0}})
+            # Snapshots without statistics are ignored
+            cache_storage.save(None, 'b', 'data', 40, 0)
+
+            assert cache_storage.get_all_stats() == {'a': {'retrieve': {'wall': 3.0, 'cpu': 0.0}},
+                                                     'b': {'retrieve': {'wall': 5.0, 'cpu': 0.0}}}
+        finally:
+            cache_storage.close()
+
+
+def test_jobs_are_ordered_longest_first():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            jobs = [ShellJob(command='fast'), ShellJob(command='slow'), ShellJob(command='new'),
+                    ShellJob(command='tagged', tags=['important']), ShellJob(command='urgent', priority=10)]
+            for job, wall in ((jobs[0], 0.1), (jobs[1], 5), (jobs[3], 0.1), (jobs[4], 0.1)):
+                cache_storage.save(None, job.get_guid(), 'data', time.time(), 0,
+                                   stats={'retrieve': {'wall': wall, 'cpu': 0}, 'response': {'wall': wall, 'cpu': 0}})
+
+            config = copy.deepcopy(storage.DEFAULT_CONFIG)
+            config['job_order']['tags'] = {'important': 1}
+            urlwatcher = types.SimpleNamespace(config_storage=types.SimpleNamespace(config=config),
+                                               cache_storage=cache_storage)
+
+            ordered = [job.command for job in worker.order_jobs(urlwatcher, jobs)]
+            assert ordered == ['urgent', 'tagged', 'new', 'slow', 'fast']
+
+            config['job_order']['longest_first'] = False
+            ordered = [job.command for job in worker.order_jobs(urlwatcher, jobs)]
+            assert ordered == ['urgent', 'tagged', 'fast', 'slow', 'new']
+        finally:
+            cache_storage.close()
+
+
+def test_jobs_are_stopped_at_their_deadline(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        marker = os.path.join(tmpdir, 'marker')
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            config = copy.deepcopy(storage.DEFAULT_CONFIG)
+            config['report']['stdout']['enabled'] = False
+            urlwatcher = types.SimpleNamespace(
+                urlwatch_config=types.SimpleNamespace(tags=False, idx_set=frozenset(), joblist=[], deadline='2s'),
+                config_storage=types.SimpleNamespace(config=config),
+                cache_storage=cache_storage,
+                jobs=[ShellJob(command='(sleep 3; touch {}) & wait'.format(marker), max_runtime=1, priority=2),
+                      # Filters cannot be stopped, the job is given up on
+                      ShellJob(command='echo slow filter', filter=[{'shellpipe': 'sleep 4'}], priority=1),
+                      ShellJob(command='echo never started')],
+                should_run=lambda idx, job: True,
+            )
+            urlwatcher.report = Report(urlwatcher)
+            monkeypatch.setattr(worker, 'MAX_WORKERS', 1)
+
+            start = time.monotonic()
+            worker.run_jobs(urlwatcher)
+            assert time.monotonic() - start < 2 + worker.DEADLINE_GRACE + 0.5
+
+            messages = {job_state.job.command: job_state.traceback for job_state in urlwatcher.report.job_states}
+            assert all(job_state.verb == 'error' for job_state in urlwatcher.report.job_states)
+            assert 'killed after running for 1 seconds' in messages[urlwatcher.jobs[0].command]
+            assert 'did not finish within' in messages['echo slow filter']
+            assert 'did not start' in messages['echo never started']
+
+            # The whole process group of the command was killed
+            time.sleep(1)
+            assert not os.path.exists(marker)
+        finally:
+            cache_storage.close()
+
+
+def test_max_runtime_without_deadline_of_the_run(monkeypatch):
+    process_job = worker.process_job
+    # Start the job only after the main thread waits for it
+    monkeypatch.setattr(worker, 'process_job', lambda job_state: time.sleep(0.2) or process_job(job_state))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            config = copy.deepcopy(storage.DEFAULT_CONFIG)
+            config['report']['stdout']['enabled'] = False
+            urlwatcher = types.SimpleNamespace(
+                urlwatch_config=types.SimpleNamespace(tags=False, idx_set=frozenset(), joblist=[], deadline=None),
+                config_storage=types.SimpleNamespace(config=config),
+                cache_storage=cache_storage,
+                # The job hangs in a filter, which cannot be stopped at its deadline
+                jobs=[ShellJob(command='echo test', filter=[{'shellpipe': 'sleep 10'}], max_runtime=1)],
+                should_run=lambda idx, job: True,
+            )
+            urlwatcher.report = Report(urlwatcher)
+
+            start = time.monotonic()
+            worker.run_jobs(urlwatcher)
+            assert time.monotonic() - start < 1 + 2 * worker.DEADLINE_GRACE + 0.5
+
+            job_state, = urlwatcher.report.job_states
+            assert job_state.verb == 'error'
+            assert 'did not finish within' in job_state.traceback
+        finally:
+            cache_storage.close()
+
+
+def test_jobs_given_up_on_do_not_keep_the_process_alive():
+    code = '\n'.join((
+        'import time',
+        'from urlwatch import worker',
+        'deadline = time.monotonic()',
+        'print(list(worker.run_parallel(time.sleep, [60], lambda item: deadline, lambda item: "timeout")))',
+    ))
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(urlwatch.__file__)))
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, timeout=30)
+    assert result.stdout.strip() == "['timeout']"
+    assert time.monotonic() - start < 10
+
+
+def test_abandoned_job_state_is_not_reported():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_storage = CacheMiniDBStorage(os.path.join(tmpdir, 'cache.db'))
+        try:
+            job_state = JobState(cache_storage, ShellJob(command='echo test'))
+            job_state.started = time.monotonic()
+            timed_out = job_state.time_out()
+            assert timed_out is not job_state
+            assert 'did not finish within' in timed_out.traceback
+            assert timed_out.tries == 1
+
+            # The worker thread can still finish the job without affecting the job state that is reported
+            job_state.process()
+            assert job_state.exception is None
+            assert timed_out.new_data is None
+        finally:
+            cache_storage.close()
@@ -0,0 +1,45 @@
+import pstats
+import threading
+import time
+
+from urlwatch import profiler
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profiler_breaks_down_stages_of_all_threads(tmp_path, capsys):
+    filename = str(tmp_path / 'urlwatch.prof')
+
+    def worker():
+        with profiler.stage('job'):
+            with profiler.stage('filter:html2text'):
+                busy(0.1)
+
+    with profiler.Profiler(filename):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        with profiler.stage('save'):
+            busy(0.05)
+
+    assert profiler.active is None
+
+    functions = [function for _, _, function in pstats.Stats(filename).stats]
+    assert 'busy' in functions
+
+    with open(filename + '.collapsed') as fp:
+        stacks = [line.rsplit(' ', 1)[0] for line in fp]
+    assert any(stack.startswith('filter;') and 'busy' in stack for stack in stacks)
+    assert any(stack.startswith('storage;') and 'busy' in stack for stack in stacks)
+
+    summary = capsys.readouterr().err
+    assert 'filter: ' in summary and 'storage: ' in summary
+
+
+def test_stage_without_profiler_is_noop():
+    with profiler.stage('retrieve'):
+        pass
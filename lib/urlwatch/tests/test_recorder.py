@@ -0,0 +1,85 @@
+import copy
+import types
+
+import pytest
+import requests
+
+from urlwatch import recorder, storage
+from urlwatch.benchmark import FixtureServer
+from urlwatch.handler import JobState, Report
+from urlwatch.jobs import ShellJob, UrlJob
+from urlwatch.main import Urlwatch
+from urlwatch.reporters import ReporterBase
+
+
+def test_record_and_replay_url_job(tmp_path):
+    dirname = str(tmp_path / 'archive')
+
+    with FixtureServer(size=500, change_percent=100) as server:
+        job = UrlJob(url=server.url + '/page/1')
+        missing_job = UrlJob(url=server.url + '/missing')
+
+        with recorder.Recorder(dirname):
+            recorded = job.retrieve(JobState(None, job))
+            with pytest.raises(requests.exceptions.HTTPError):
+                missing_job.retrieve(JobState(None, missing_job))
+
+        server.run = 1
+        assert job.retrieve(JobState(None, job)) != recorded
+
+    with recorder.Recorder(dirname, replay=True):
+        job_state = JobState(None, job)
+        assert job.retrieve(job_state) == recorded
+        assert job_state.http_status == 200
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            missing_job.retrieve(JobState(None, missing_job))
+
+        other_job = UrlJob(url='http://localhost/not-recorded')
+        with pytest.raises(recorder.ReplayError):
+            other_job.retrieve(JobState(None, other_job))
+
+    assert recorder.active is None
+
+
+def test_record_and_replay_shell_job(tmp_path):
+    filename = tmp_path / 'counter'
+    filename.write_text('1')
+    job = ShellJob(command='cat {}'.format(filename))
+
+    with recorder.Recorder(str(tmp_path / 'archive')):
+        assert job.retrieve(JobState(None, job)) == '1'
+
+    filename.write_text('2')
+    with recorder.Recorder(str(tmp_path / 'archive'), replay=True):
+        assert job.retrieve(JobState(None, job)) == '1'
+
+
+def test_replay_uses_encoding_from_headers(tmp_path):
+    job = UrlJob(url='http://localhost/latin')
+    entry = recorder.response_to_dict(types.SimpleNamespace(
+        url=job.url, status_code=200, reason='OK',
+        headers={'Content-Type': 'text/plain; charset=windows-1252'},
+        content='naïve – 5 €'.encode('windows-1252'),
+    ))
+    recorder.Recorder(str(tmp_path)).save(job, entry)
+
+    with recorder.Recorder(str(tmp_path), replay=True):
+        assert job.retrieve(JobState(None, job)) == 'naïve – 5 €'
+
+
+def test_replay_only_reports_to_stdout(tmp_path):
+    config = copy.deepcopy(storage.DEFAULT_CONFIG)
+    config['report']['email']['enabled'] = True
+    config['spool']['enabled'] = True
+    urlwatcher = Urlwatch.__new__(Urlwatch)
+    urlwatcher.config_storage = types.SimpleNamespace(config=config)
+    urlwatcher.urlwatch_config = types.SimpleNamespace(replay=str(tmp_path), replay_reports=False)
+
+    assert ReporterBase.enabled_reporters(Report(urlwatcher)) == ['stdout']
+    assert urlwatcher.open_spool() is None
+    # The configuration itself is not changed
+    assert config['report']['email']['enabled']
+
+    urlwatcher.urlwatch_config.replay_reports = True
+    assert set(ReporterBase.enabled_reporters(Report(urlwatcher))) == {'email', 'stdout'}
@@ -0,0 +1,422 @@
+import copy
+import datetime
+import json
+import threading
+import time
+import types
+
+from urlwatch.handler import JobState, Report
+from urlwatch.jobs import JobBase
+from urlwatch import mailer
+from urlwatch.spool import NotificationSpool
+from urlwatch.reporters import HtmlReporter, NdjsonReporter, PrometheusReporter, ReporterBase, IFTTTReport, NtfyReporter, ShellReporter, TextReporter
+from urlwatch.storage import DEFAULT_CONFIG
+from urlwatch.webhook import WebhookSender
+
+
+def make_report(config=None):
+    config = copy.deepcopy(config or DEFAULT_CONFIG)
+    urlwatcher = types.SimpleNamespace(config_storage=types.SimpleNamespace(config=config))
+    return Report(urlwatcher)
+
+
+def make_job_state(old_data, new_data, **job):
+    job_state = JobState(None, JobBase.unserialize({'url': 'http://example.com/', **job}))
+    job_state.old_data = old_data
+    job_state.new_data = new_data
+    return job_state
+
+
+def test_html_table_diff():
+    report = make_report()
+    old_data = ''.join('line %d\n' % i for i in range(100))
+    new_data = old_data.replace('line 50\n', 'line <50>\n').replace('line 90\n', '')
+    job_state = make_job_state(old_data, new_data)
+    report.changed(job_state)
+
+    reporter = HtmlReporter(report, {}, report.job_states, datetime.timedelta())
+    table = ''.join(str(part) for part in reporter._format_content(job_state, 'table'))
+
+    assert table.count('<tbody>') == 2
+    assert 'line&nbsp;<span class="diff_chg">&lt;50&gt;</span>' in table
+    assert '<span class="diff_sub">line&nbsp;90</span>' in table
+    # Only context lines around the changes are shown
+    assert 'line&nbsp;10<' not in table
+    assert 'line&nbsp;47<' in table and 'line&nbsp;46<' not in table
+
+
+def test_html_unified_diff_to_html():
+    report = make_report()
+    reporter = HtmlReporter(report, {}, [], datetime.timedelta())
+
+    assert list(reporter._diff_to_html('@@ -1 +1 @@\n-a b\n+a {+c+} [-d-] x\n same')) == [
+        '<span class="unified_nor">@@ -1 +1 @@',
+        '<span class="unified_sub">-a b</span>',
+        '<span class="unified_add">+a <span class="diff_add">{+c+}</span> <span class="diff_sub">[-d-]</span> x</span>',
+        ' same</span>',
+    ]
+
+    # wdiff markers spanning multiple lines are closed and re-opened on each line
+    assert list(reporter._diff_to_html('a {+b\nc+} d', '<pre>', '</pre>')) == [
+        '<pre><span class="unified_nor">a <span class="diff_add">{+b</span>',
+        '<span class="diff_add">c+}</span> d</span></pre>',
+    ]
+
+
+def test_submit_all_isolates_errors_and_timeouts(monkeypatch):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+    config['report']['ifttt'].update(enabled=True, timeout=0.1)
+    config['report']['ntfy']['enabled'] = True
+    config['report']['text']['separate'] = True
+    config['report']['shell'].update(enabled=True)
+    report = make_report(config)
+    for idx in range(3):
+        report.changed(make_job_state('a', 'b', url='http://example.com/%d' % idx))
+
+    hang = threading.Event()
+    submitted = []
+
+    def failing_submit(self):
+        raise ValueError('Reporter failed')
+
+    monkeypatch.setattr(IFTTTReport, 'submit', lambda self: hang.wait())
+    monkeypatch.setattr(NtfyReporter, 'submit', lambda self: submitted.append(self.job_states))
+    monkeypatch.setattr(ShellReporter, 'submit', failing_submit)
+
+    start = time.monotonic()
+    ReporterBase.submit_all(report, report.job_states, datetime.timedelta())
+    hang.set()
+
+    assert time.monotonic() - start < 5
+    assert sorted(len(job_states) for job_states in submitted) == [1, 1, 1]
+
+
+def test_submit_all_uses_timeout_of_base_reporter(monkeypatch):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+    config['report']['ifttt']['enabled'] = True
+    config['report']['text']['timeout'] = 0.1
+    report = make_report(config)
+    report.changed(make_job_state('a', 'b'))
+
+    hang = threading.Event()
+    monkeypatch.setattr(IFTTTReport, 'submit', lambda self: hang.wait())
+
+    start = time.monotonic()
+    assert ReporterBase.submit_all(report, report.job_states, datetime.timedelta()) == [False]
+    hang.set()
+    assert time.monotonic() - start < 5
+
+
+class FakeSMTP(object):
+    connections = []
+
+    def __init__(self, host, port):
+        self.sent = []
+        self.disconnect = False
+        FakeSMTP.connections.append(self)
+
+    def ehlo(self):
+        ...
+
+    def starttls(self):
+        ...
+
+    def login(self, user, password):
+        ...
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.disconnect:
+            raise mailer.smtplib.SMTPServerDisconnected()
+        self.sent.append(to_addrs)
+        if len(self.sent) == 2:
+            # Simulate the server dropping the connection after two messages
+            self.disconnect = True
+
+    def quit(self):
+        ...
+
+
+def test_email_separate_reuses_smtp_session(monkeypatch):
+    monkeypatch.setattr(mailer.smtplib, 'SMTP', FakeSMTP)
+    monkeypatch.setattr(FakeSMTP, 'connections', [])
+
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['text']['separate'] = True
+    config['report']['email'].update(enabled=True, to='you@example.org', **{'from': 'urlwatch@example.org'})
+    config['report']['email']['smtp']['insecure_password'] = 'secret'
+    report = make_report(config)
+    for idx in range(5):
+        report.changed(make_job_state('a', 'b', url='http://example.com/%d' % idx))
+
+    ReporterBase.submit_one('email', report, report.job_states, datetime.timedelta())
+
+    assert [len(connection.sent) for connection in FakeSMTP.connections] == [2, 2, 1]
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None, data=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = 'https://example.com/webhook'
+        self.data = data
+
+    def json(self):
+        if self.data is None:
+            raise ValueError('No JSON')
+        return self.data
+
+
+def test_webhook_sender_retries_after_rate_limit(monkeypatch):
+    sender = WebhookSender(rate=1000, capacity=1)
+    responses = [
+        FakeResponse(429, headers={'Retry-After': '0.05'}),
+        FakeResponse(429, data={'parameters': {'retry_after': 0.05}}),
+        FakeResponse(200),
+    ]
+    posted = []
+
+    def fake_post(url, **kwargs):
+        posted.append((url, kwargs))
+        return responses.pop(0)
+
+    monkeypatch.setattr(sender.session, 'post', fake_post)
+
+    start = time.monotonic()
+    response = sender.post('https://example.com/webhook', json={'text': 'hello'})
+
+    assert response.status_code == 200
+    assert len(posted) == 3
+    assert posted[0][1]['timeout'] == WebhookSender.TIMEOUT
+    assert time.monotonic() - start >= 0.1
+
+
+def test_webhook_sender_ignores_malformed_retry_after():
+    assert WebhookSender._retry_after(FakeResponse(429, headers={'Retry-After': 'not a date'}), 2) == 4
+
+
+def test_spool_keeps_undelivered_reports(monkeypatch, tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+    config['report']['shell']['enabled'] = True
+    report = make_report(config)
+    report.spool = NotificationSpool(str(tmp_path / 'spool.db'), max_tries=3)
+    report.changed(make_job_state('a', 'b'))
+    report.unchanged(make_job_state('c', 'c', url='http://example.com/unchanged'))
+
+    delivered = []
+
+    def failing_submit(self):
+        raise ValueError('Reporter failed')
+
+    def submit(self):
+        delivered.append([(job_state.verb, job_state.get_diff() if job_state.verb == 'changed' else None)
+                          for job_state in self.job_states])
+
+    monkeypatch.setattr(ShellReporter, 'submit', failing_submit)
+    report.finish()
+    assert len(report.spool.pending()) == 1
+    assert report.spool.pending()[0].tries == 1
+
+    monkeypatch.setattr(ShellReporter, 'submit', submit)
+    assert report.spool.flush(report) == 0
+    assert report.spool.pending() == []
+    assert len(delivered) == 1
+    (verb, diff), (unchanged_verb, _) = delivered[0]
+    assert verb == 'changed' and '+b' in diff
+    assert unchanged_verb == 'unchanged'
+
+    # Reports are dropped after max_tries failed deliveries
+    monkeypatch.setattr(ShellReporter, 'submit', failing_submit)
+    report.finish()
+    assert report.spool.flush(report) == 1
+    assert report.spool.flush(report) == 0
+    assert report.spool.pending() == []
+    report.spool.close()
+
+
+def test_ndjson_reporter_writes_one_record_per_job(tmp_path):
+    report = make_report()
+    report.changed(make_job_state('a\n', 'b\n'))
+    report.unchanged(make_job_state('c', 'c', url='http://example.com/unchanged'))
+    error_state = make_job_state(None, None, url='http://example.com/error')
+    error_state.traceback = 'Traceback\nValueError: broken\n'
+    report.error(error_state)
+
+    path = tmp_path / 'report.ndjson'
+    NdjsonReporter(report, {'path': str(path)}, report.job_states, datetime.timedelta()).submit()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    # Unchanged jobs are not displayed in the default configuration
+    assert [record['verb'] for record in records] == ['changed', 'error']
+    assert records[0]['location'] == 'http://example.com/'
+    assert records[0]['guid'] == report.job_states[0].job.get_guid()
+    assert '+b' in records[0]['diff']
+    assert records[1]['error'] == 'Traceback\nValueError: broken'
+
+
+def test_ndjson_reporter_writes_to_stdout(capsys):
+    report = make_report()
+    report.changed(make_job_state('a\n', 'b\n'))
+
+    NdjsonReporter(report, {'path': ''}, report.job_states, datetime.timedelta()).submit()
+
+    record, = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert record['verb'] == 'changed'
+
+
+def test_incremental_reporter_gets_jobs_as_they_finish(capsys):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout'].update(incremental=True, color=False)
+    report = make_report(config)
+
+    job_state = make_job_state('a\n', 'b\n')
+    report.changed(job_state)
+    report.job_finished(job_state)
+    assert 'CHANGED: http://example.com/' in capsys.readouterr().out
+    # No other reporter needs the page contents anymore
+    assert job_state.old_data is None and job_state.new_data is None
+
+    unchanged_state = make_job_state('c', 'c', url='http://example.com/unchanged')
+    report.unchanged(unchanged_state)
+    report.job_finished(unchanged_state)
+    assert capsys.readouterr().out == ''
+
+    # Jobs that have already been reported are not reported again
+    report.finish()
+    assert capsys.readouterr().out == ''
+
+
+def test_release_keeps_only_what_is_reported():
+    report = make_report()
+    changed_state = make_job_state('a\n', 'b\n')
+    unchanged_state = make_job_state('c', 'c', url='http://example.com/unchanged')
+    new_state = make_job_state(None, 'd', url='http://example.com/new')
+    report.changed(changed_state)
+    report.unchanged(unchanged_state)
+    report.new(new_state)
+
+    changed_state.get_diff()
+    for job_state in report.job_states:
+        report.job_finished(job_state)
+        assert job_state.old_data is None and job_state.new_data is None
+
+    text = '\n'.join(TextReporter(report, {}, report.job_states, datetime.timedelta()).submit())
+    assert '+b' in text
+
+    # The HTML table diff needs the page contents of changed jobs
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['html']['diff'] = 'table'
+    config['display']['unchanged'] = True
+    report = make_report(config)
+    changed_state = make_job_state('a\n', 'b\n')
+    unchanged_state = make_job_state('c', 'c', url='http://example.com/unchanged')
+    report.changed(changed_state)
+    report.unchanged(unchanged_state)
+    changed_state.get_diff()
+    for job_state in report.job_states:
+        report.job_finished(job_state)
+    assert changed_state.new_data == 'b\n'
+    assert unchanged_state.old_data == 'c'
+
+
+def test_prometheus_reporter_writes_textfile(tmp_path):
+    report = make_report()
+    job_state = make_job_state('a', 'b', name='My "page"')
+    job_state.stats = {'retrieve': {'wall': 1.5, 'cpu': 0.1}, 'filter:html2text': {'wall': 0.25, 'cpu': 0.25},
+                       'filter:strip': {'wall': 0.25, 'cpu': 0.25}}
+    job_state.http_status = 200
+    job_state.bytes_received = 1234
+    report.changed(job_state)
+    report.unchanged(make_job_state('c', 'c', url='http://example.com/unchanged'))
+    # Errors that are retried are not reported, but their tries are exported
+    retried_state = make_job_state(None, None, url='http://example.com/retried')
+    retried_state.tries = 2
+    for finished_state in report.job_states + [retried_state]:
+        report.job_finished(finished_state)
+
+    path = tmp_path / 'urlwatch.prom'
+    PrometheusReporter(report, {'path': str(path)}, report.job_states, datetime.timedelta(seconds=3)).submit()
+
+    lines = path.read_text().splitlines()
+    assert 'urlwatch_run_duration_seconds 3.0' in lines
+    assert 'urlwatch_jobs{verb="changed"} 1' in lines
+    assert 'urlwatch_jobs{verb="error"} 0' in lines
+    labels = '{{guid="{}",name="My \\"page\\"",location="http://example.com/"}}'.format(job_state.job.get_guid())
+    assert 'urlwatch_job_retrieve_seconds' + labels + ' 1.5' in lines
+    assert 'urlwatch_job_filter_seconds' + labels + ' 0.5' in lines
+    assert 'urlwatch_job_http_status' + labels + ' 200' in lines
+    assert 'urlwatch_job_received_bytes' + labels + ' 1234' in lines
+    # Jobs without HTTP status (or timing) are left out of the respective metric
+    assert sum(line.startswith('urlwatch_job_http_status{') for line in lines) == 1
+    assert sum(line.startswith('urlwatch_job_tries{') for line in lines) == 3
+    assert any(line.startswith('urlwatch_job_tries{') and 'retried' in line and line.endswith(' 2') for line in lines)
+    assert not (tmp_path / 'urlwatch.prom.tmp').exists()
+
+
+def test_spool_only_retries_failed_separate_reports(monkeypatch, tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+    config['report']['text']['separate'] = True
+    config['report']['shell']['enabled'] = True
+    report = make_report(config)
+    report.spool = NotificationSpool(str(tmp_path / 'spool.db'))
+    for idx in range(3):
+        report.changed(make_job_state('a', 'b', url='http://example.com/{}'.format(idx)))
+
+    delivered = []
+    failing = {'http://example.com/1'}
+
+    def submit(self):
+        location, = [job_state.job.get_location() for job_state in self.job_states]
+        if location in failing:
+            raise ValueError('Reporter failed')
+        delivered.append(location)
+
+    monkeypatch.setattr(ShellReporter, 'submit', submit)
+    report.finish()
+    assert sorted(delivered) == ['http://example.com/0', 'http://example.com/2']
+    assert len(report.spool.pending()) == 1
+
+    failing.clear()
+    assert report.spool.flush(report) == 0
+    assert delivered[2:] == ['http://example.com/1']
+    report.spool.close()
+
+
+def test_spool_queues_binary_job_data(monkeypatch, tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+    config['report']['shell']['enabled'] = True
+    report = make_report(config)
+    report.spool = NotificationSpool(str(tmp_path / 'spool.db'), flush=False)
+    report.new(make_job_state(None, b'\x89PNG\r\n\x1a\n\x00\xff'))
+    report.finish()
+    assert len(report.spool.pending()) == 1
+
+    delivered = []
+    monkeypatch.setattr(ShellReporter, 'submit', lambda self: delivered.extend(self.job_states))
+    assert report.spool.flush(report) == 0
+    assert delivered[0].verb == 'new'
+    assert delivered[0].new_data == b'\x89PNG\r\n\x1a\n\x00\xff'
+    report.spool.close()
+
+
+def test_spool_flush_at_end_of_run_is_time_boxed(monkeypatch, tmp_path):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config['report']['stdout']['enabled'] = False
+    config['report']['shell']['enabled'] = True
+    report = make_report(config)
+    report.spool = NotificationSpool(str(tmp_path / 'spool.db'), flush_timeout=0.1)
+    report.changed(make_job_state('a', 'b'))
+
+    hanging = threading.Event()
+    monkeypatch.setattr(ShellReporter, 'submit', lambda self: hanging.wait(10))
+    start = time.monotonic()
+    report.finish()
+    assert time.monotonic() - start < 5
+    # The report stays queued for the next flush
+    assert len(report.spool.pending()) == 1
+    hanging.set()
+    report.spool.close()
@@ -26,3 +26,14 @@ TESTDATA = [
 @pytest.mark.parametrize('string, length, numbering, output', TESTDATA)
 def test_chunkstring(string, length, numbering, output):
     assert list(chunkstring(string, length, numbering=numbering)) == output
+
+
+def test_chunkstring_numbering_more_than_nine_chunks():
+    string = ' '.join('word%03d' % i for i in range(200))
+    chunks = list(chunkstring(string, 20, numbering=True))
+
+    assert len(chunks) > 99
+    assert all(len(chunk) <= 20 for chunk in chunks)
+    assert chunks[0] == 'word000 (1/%d)' % len(chunks)
+    assert chunks[-1] == 'word199 (%d/%d)' % (len(chunks), len(chunks))
+    assert ' '.join(chunk.rsplit(' ', 1)[0] for chunk in chunks) == string
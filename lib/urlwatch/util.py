@@ -36,6 +36,7 @@ import shlex
 import importlib.machinery
 import importlib.util
 import sys
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -94,6 +95,13 @@ def atomic_rename(old_filename, new_filename):
         os.rename(old_filename, new_filename)
 
 
+def start_daemon_thread(target, *args, name=None):
+    # Daemon threads do not keep the process alive if they hang (e.g. a reporter or a job that was given up on)
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
 def edit_file(filename):
     editor = os.environ.get('EDITOR', None)
     if not editor:
@@ -113,28 +121,48 @@ def import_module_from_source(module_name, source_path):
     return module
 
 
+def _chunk_boundaries(string, start, end, length):
+    """Split string[start:end] into (start, end) index pairs of at most length characters each"""
+    boundaries = []
+    while start < end:
+        if end - start <= length:
+            boundaries.append((start, end))
+            break
+
+        idx = string.rfind(' ', start + 1, start + length + 1)
+        if idx == -1:
+            idx = string.rfind('\n', start + 1, start + length + 1)
+        if idx == -1:
+            idx = start + length
+        boundaries.append((start, idx))
+
+        start = idx
+        while start < end and string[start].isspace():
+            start += 1
+
+    return boundaries
+
+
 def chunkstring(string, length, *, numbering=False):
     if len(string) <= length:
         return [string]
 
     if numbering:
-        # Subtract to fit numbering (FIXME: this breaks for > 9 chunks)
-        length -= len(' (0/0)')
-        parts = []
-        string = string.strip()
-        while string:
-            if len(string) <= length:
-                parts.append(string)
-                string = ''
+        start, end = 0, len(string)
+        while start < end and string[start].isspace():
+            start += 1
+        while end > start and string[end - 1].isspace():
+            end -= 1
+
+        # Reserve space for the numbering, adding a digit until the chunk count fits
+        digits = 1
+        while True:
+            boundaries = _chunk_boundaries(string, start, end, max(1, length - len(' (/)') - 2 * digits))
+            if len(str(len(boundaries))) <= digits:
                 break
+            digits += 1
 
-            idx = string.rfind(' ', 1, length + 1)
-            if idx == -1:
-                idx = string.rfind('\n', 1, length + 1)
-            if idx == -1:
-                idx = length
-            parts.append(string[:idx])
-            string = string[idx:].strip()
-        return ('{} ({}/{})'.format(part, i + 1, len(parts)) for i, part in enumerate(parts))
+        count = len(boundaries)
+        return ('{} ({}/{})'.format(string[i:j], idx, count) for idx, (i, j) in enumerate(boundaries, 1))
 
     return (string[i:length + i].strip() for i in range(0, len(string), length))
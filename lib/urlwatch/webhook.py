@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of urlwatch (https://thp.io/2008/urlwatch/).
+# Copyright (c) 2008-2024 Thomas Perl <m@thp.io>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. The name of the author may not be used to endorse or promote products
+#    derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+# THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import email.utils
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket allowing `capacity` requests at once, refilled at `rate` requests per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        with self.lock:
+            self._refill()
+            # Take the token now (possibly going into debt), and wait until it would have been available
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class WebhookSender(object):
+    """Deliver HTTP POST requests over a pooled session, respecting per-endpoint rate limits
+
+    Every endpoint (by default the URL, or an explicit key, e.g. a chat ID)
+    gets its own token bucket. If the service still answers with HTTP 429,
+    the request is retried after the time given by the service (Retry-After).
+    """
+
+    MAX_RETRIES = 5
+    TIMEOUT = 60
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.session = requests.Session()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            return bucket
+
+    @staticmethod
+    def _retry_after(response, attempt):
+        value = response.headers.get('Retry-After')
+        if value:
+            try:
+                return max(0, float(value))
+            except ValueError:
+                pass
+
+            try:
+                retry_at = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                # Malformed date (Python 3.10+ raises instead of returning None), use the normal backoff
+                retry_at = None
+            if retry_at is not None:
+                return max(0, retry_at.timestamp() - time.time())
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+
+        if isinstance(data, dict):
+            # Discord: {"retry_after": 1.5}, Telegram: {"parameters": {"retry_after": 2}}
+            value = data.get('retry_after', data.get('parameters', {}).get('retry_after'))
+            if value is not None:
+                return max(0, float(value))
+
+        return 2 ** attempt
+
+    def post(self, url, key=None, **kwargs):
+        kwargs.setdefault('timeout', self.TIMEOUT)
+        bucket = self._get_bucket(url if key is None else key)
+
+        for attempt in range(self.MAX_RETRIES + 1):
+            bucket.acquire()
+            response = self.session.post(url, **kwargs)
+            if response.status_code != requests.codes.too_many_requests or attempt == self.MAX_RETRIES:
+                return response
+
+            delay = self._retry_after(response, attempt)
+            logger.info('Rate limited by %s, retrying in %.1f seconds', response.url or url, delay)
+            bucket.pause(delay)
+
+        return response
@@ -28,42 +28,137 @@
 # THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import collections
 import concurrent.futures
 import logging
-import difflib
 import contextlib
+import time
 
-from .handler import JobState
-from .jobs import NotModifiedError
+from . import profiler
+from .handler import JobState, stats_total
+from .jobs import NotModifiedError, parse_interval
+from .util import start_daemon_thread
 
 logger = logging.getLogger(__name__)
 
 MAX_WORKERS = 10
 
+# Seconds to wait for an item after its deadline (jobs stop themselves at their deadline where possible)
+DEADLINE_GRACE = 1
 
-def run_parallel(func, items):
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
-    for future in concurrent.futures.as_completed(executor.submit(func, item) for item in items):
-        exception = future.exception()
-        if exception is not None:
-            raise exception
-        yield future.result()
 
+def run_parallel(func, items, get_deadline=lambda item: None, on_timeout=None):
+    """Run func for all items in worker threads, yields the results as they are finished
 
-def run_jobs(urlwatcher):
+    Items that are not finished DEADLINE_GRACE seconds after their deadline
+    (time.monotonic() value returned by get_deadline) are given up on, and
+    on_timeout(item) is yielded instead. The worker threads are daemon threads,
+    so that a job that is given up on does not keep the process alive.
+    """
+    futures = {concurrent.futures.Future(): item for item in items}
+    queue = collections.deque(futures)
+
+    def worker():
+        while True:
+            try:
+                future = queue.popleft()
+            except IndexError:
+                return
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = func(futures[future])
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    for _ in range(min(MAX_WORKERS, len(futures))):
+        start_daemon_thread(worker)
+
+    pending = set(futures)
+    try:
+        while pending:
+            deadlines = [get_deadline(futures[future]) for future in pending]
+            # Items can get a deadline once they are started (e.g. max_runtime), so check again regularly
+            timeout = DEADLINE_GRACE if None in deadlines else None
+            deadlines = [deadline for deadline in deadlines if deadline is not None]
+            if deadlines:
+                timeout = min(timeout or float('inf'), max(0, min(deadlines) + DEADLINE_GRACE - time.monotonic()))
+
+            done, pending = concurrent.futures.wait(pending, timeout, concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                exception = future.exception()
+                if exception is not None:
+                    raise exception
+                yield future.result()
+
+            now = time.monotonic()
+            for future in list(pending):
+                deadline = get_deadline(futures[future])
+                if not future.done() and deadline is not None and now >= deadline + DEADLINE_GRACE:
+                    # Not started yet, or still running (the thread cannot be stopped, but we do not wait for it)
+                    future.cancel()
+                    pending.remove(future)
+                    logger.warning('Giving up on %s after its deadline', futures[future])
+                    yield on_timeout(futures[future])
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def process_job(job_state):
+    with profiler.stage('job'):
+        return job_state.process()
+
+
+def select_jobs(urlwatcher):
     if not urlwatcher.urlwatch_config.tags and not all(1 <= idx <= len(urlwatcher.jobs) for idx in urlwatcher.urlwatch_config.idx_set):
         raise ValueError(f'All job indices must be between 1 and {len(urlwatcher.jobs)}: {urlwatcher.urlwatch_config.joblist}')
+    return [job for (idx, job) in enumerate(urlwatcher.jobs, 1) if urlwatcher.should_run(idx, job)]
+
+
+def get_priority(job, tag_priorities):
+    if job.priority is not None:
+        return int(job.priority)
+    return max((tag_priorities.get(tag, 0) for tag in job.tags or ()), default=0)
+
+
+def order_jobs(urlwatcher, jobs):
+    """Order jobs by priority, and start the jobs that took longest in their last run first"""
+    config = urlwatcher.config_storage.config.get('job_order', {})
+    tag_priorities = config.get('tags') or {}
+
+    durations = {}
+    if config.get('longest_first', True):
+        durations = {guid: stats_total(stats)[0] for guid, stats in urlwatcher.cache_storage.get_all_stats().items()}
+
+    # Jobs without statistics might be slow, start them early (in their original order)
+    return sorted(jobs, key=lambda job: (-get_priority(job, tag_priorities),
+                                         -durations.get(job.get_guid(), float('inf'))))
+
+
+def run_jobs(urlwatcher, jobs=None):
+    if jobs is None:
+        jobs = select_jobs(urlwatcher)
     cache_storage = urlwatcher.cache_storage
-    jobs = [job.with_defaults(urlwatcher.config_storage.config)
-            for (idx, job) in enumerate(urlwatcher.jobs, 1)
-            if urlwatcher.should_run(idx, job)
-            ]
+    jobs = order_jobs(urlwatcher, [job.with_defaults(urlwatcher.config_storage.config) for job in jobs])
     report = urlwatcher.report
 
+    deadline = getattr(urlwatcher.urlwatch_config, 'deadline', None)
+    if deadline is not None:
+        deadline = time.monotonic() + parse_interval(deadline)
+
+    # Statistics of unchanged jobs are written together at the end of the run
+    stats_updates = []
+
     logger.debug('Processing %d jobs (out of %d)', len(jobs), len(urlwatcher.jobs))
     with contextlib.ExitStack() as exit_stack:
-        for job_state in run_parallel(lambda job_state: job_state.process(),
-                                      (exit_stack.enter_context(JobState(cache_storage, job)) for job in jobs)):
+        for job_state in run_parallel(process_job,
+                                      (exit_stack.enter_context(JobState(cache_storage, job, deadline)) for job in jobs),
+                                      lambda job_state: job_state.deadline, lambda job_state: job_state.time_out()):
             logger.debug('Job finished: %s', job_state.job)
 
             if not job_state.job.max_tries:
@@ -81,6 +176,8 @@ def run_jobs(urlwatcher):
                     if job_state.tries > 0:
                         job_state.tries = 0
                         job_state.save()
+                    else:
+                        stats_updates.append(job_state.get_stats_update())
                 elif job_state.tries < max_tries:
                     logger.debug('This was try %i of %i for job %s', job_state.tries,
                                  max_tries, job_state.job)
@@ -91,19 +188,14 @@ def run_jobs(urlwatcher):
                     report.error(job_state)
 
             elif job_state.old_data is not None:
-                matched_history_time = job_state.history_data.get(job_state.new_data)
-                if matched_history_time:
-                    job_state.timestamp = matched_history_time
-                if matched_history_time or job_state.new_data == job_state.old_data:
+                if not job_state.changed:
                     report.unchanged(job_state)
                     if job_state.tries > 0:
                         job_state.tries = 0
                         job_state.save()
+                    else:
+                        stats_updates.append(job_state.get_stats_update())
                 else:
-                    close_matches = difflib.get_close_matches(job_state.new_data, job_state.history_data, n=1)
-                    if close_matches:
-                        job_state.old_data = close_matches[0]
-                        job_state.timestamp = job_state.history_data[close_matches[0]]
                     report.changed(job_state)
                     job_state.tries = 0
                     job_state.save()
@@ -111,3 +203,8 @@ def run_jobs(urlwatcher):
                 report.new(job_state)
                 job_state.tries = 0
                 job_state.save()
+
+            report.job_finished(job_state)
+
+    if stats_updates:
+        cache_storage.update_stats_many(stats_updates)
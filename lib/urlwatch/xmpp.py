@@ -50,27 +50,36 @@ class XMPP(object):
         self.recipient = recipient
         self.insecure_password = insecure_password
 
-    async def send(self, chunk):
+    def _get_password(self):
         if self.insecure_password:
-            password = self.insecure_password
+            return self.insecure_password
         elif keyring is not None:
             password = keyring.get_password("urlwatch_xmpp", self.sender)
             if password is None:
                 raise ValueError(
                     "No password available in keyring for {}".format(self.sender)
                 )
+            return password
+        else:
+            raise ValueError("insecure_password is not set and keyring is not available")
+
+    async def send(self, chunk):
+        await self.send_all([chunk])
 
+    async def send_all(self, chunks):
+        """ Send all chunks as separate messages over a single connection."""
         jid = aioxmpp.JID.fromstr(self.sender)
         client = aioxmpp.PresenceManagedClient(
-            jid, aioxmpp.make_security_layer(password)
+            jid, aioxmpp.make_security_layer(self._get_password())
         )
         recipient_jid = aioxmpp.JID.fromstr(self.recipient)
 
         async with client.connected() as stream:
-            msg = aioxmpp.Message(to=recipient_jid, type_=aioxmpp.MessageType.CHAT,)
-            msg.body[None] = chunk
+            for chunk in chunks:
+                msg = aioxmpp.Message(to=recipient_jid, type_=aioxmpp.MessageType.CHAT,)
+                msg.body[None] = chunk
 
-            await stream.send_and_wait_for_sent(msg)
+                await stream.send_and_wait_for_sent(msg)
 
 
 def xmpp_have_password(sender):